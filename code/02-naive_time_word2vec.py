@@ -9,17 +9,44 @@ Modified on April 2 2024
 ##       word2vec        ##
 ##  Naive Time Analysis  ##
 
-import numpy
 import os
+import sys
 import pickle
 import csv
-import math
-from gensim.models import Word2Vec
-from sklearn.utils import resample
 import random
 
 random.seed(6801)
 
+## Run with --resume to pick up an interrupted run. Every finished replicate
+## is appended to data/naive_results.jsonl;
+## replicates already logged there are skipped.
+RESUME = '--resume' in sys.argv
+
+## Run with --adaptive to stop adding replicates to an era once every probe's
+## 95% CI half-width is under 0.01 (or 100 non-NA values are in); the fixed
+## replicate count below is then only the maximum.
+ADAPTIVE = '--adaptive' in sys.argv
+
+## Run with --events to record the wall time, CPU time and peak memory of every
+## training, alignment, model load/save and stats step in
+## data/naive_events.jsonl; with --progress, runs done and the ETA are printed
+## to stderr as the run goes.
+EVENTS = '--events' in sys.argv
+PROGRESS = '--progress' in sys.argv
+
+## Run with --redraw to redraw (up to 10 times) any bootstrap sample that is
+## missing a probe word, instead of recording NA for that probe.
+REDRAW = 10 if '--redraw' in sys.argv else 0
+
+## Run with --converge to stop training each replicate once its loss and probe
+## similarities plateau (word2vec_functions.CONVERGENCE_PARAMS) instead of
+## always running every epoch; the epochs used are logged.
+CONVERGE = '--converge' in sys.argv
+
+## Run with --no-store to not keep each replicate's vectors in
+## data/bootstrap_models (05-aligned_word2vec.py then trains its own).
+NO_STORE = '--no-store' in sys.argv
+
 ## If not using an interpreter, you can use __file__ to set the directory to the master
 dir_path = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
 
@@ -27,44 +54,39 @@ dir_path = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardi
 dir_path = '/Users/zhiqiangji/GitRepos/Rodman_demo/word2vec_time/word2vec_time'
 os.chdir(dir_path)
 
+os.chdir('./code')
+from word2vec_functions import bootstrap_era_stats, default_store, EQUALITY_PROBES, \
+    CONVERGENCE_PARAMS
+from corpus_functions import load_corpus
+from results_functions import ResultsLog, StoppingRule, BootstrapResults
+from instrument_functions import configure
+os.chdir('..')
+
 ############################# 
 # Loading all files/eras of texts into a master list of word2vec-ready sentences
 
 os.chdir('./data')
 eras = ['1855', '1880', '1905', '1930', '1955', '1980', '2005']
-data = []
-
-for era in eras:
-    path = 'processed_' + era + 'era.txt'
-    with open(path) as fp:
-        x = fp.read() 
-        data.append(x.split('\n'))
 
-list_of_lists = []
-    
-for i in data:
-    sentence_lists = []
-    for article in range(0, len(i)):
-        x = i[article].split()
-        sentence_lists.append(x)
-    list_of_lists.append(sentence_lists)
+# The era files are tokenized once into ./corpus_cache and memory-mapped on
+# later runs; the cache is rebuilt whenever a processed_<era>era.txt changes.
+corpus = load_corpus(eras)
+convergence = CONVERGENCE_PARAMS if CONVERGE else None
+log = ResultsLog('naive_results.jsonl', resume=RESUME, 
+                 settings={'convergence': convergence})
+stopping = StoppingRule() if ADAPTIVE else None
+configure('naive_events.jsonl' if EVENTS else None, PROGRESS)
     
 ## Iterating over lists of sentences by era to do era-by-era word2vec modeling
 
 #==============================================================================
-#  Note: to replicate the word2vec model results, run lines 60-139.
+#  Note: to replicate the word2vec model results, run lines 89-128.
 #  This is computationally and time intensive (3-4 hours). To replicate using
-#  model outputs from the paper, proceed to line 143 and load pickled model
+#  model outputs from the paper, proceed to line 130 and load pickled model
 #  outputs.
 #==============================================================================
 
 n_bootstraps = 200
-gender_similarity = []
-intl_similarity = []
-german_similarity = []
-race_similarity = []
-afam_similarity =[]
-equality_top10 = []
 
 #==============================================================================
 #  Add'l. note: because the output of interest a single word, resampling very small 
@@ -73,92 +95,50 @@ equality_top10 = []
 #  earliest era in this corpus. This loop appends NAs in those cases. In order
 #  to get a sample size of at least 100 cosine similarity values, a larger
 #  number of bootstraps is run than the desired final total (here, 200).
+#  Samples are checked against a word -> document index before training, so
+#  one that lacks every probe word costs no training; --redraw replaces
+#  samples missing any probe word instead.
 #==============================================================================
 
-for j in range(0, len(list_of_lists)):
-    sim_stats_gender = []
-    sim_stats_intl = []
-    sim_stats_german = []
-    sim_stats_race = []
-    sim_stats_afam = []
-    for k in range(n_bootstraps):
-        sentence_samples = resample(list_of_lists[j])
-        model = Word2Vec(sentence_samples, vector_size = 100, min_count = 0, epochs = 200, 
-                     sg = 1, hs = 0, negative = 5, window = 10, workers = 4)
-        while True:
-            try:
-                sim_stats_gender.append(model.wv.similarity('equality','gender'))
-                break
-            except KeyError:
-                sim_stats_gender.append('NA')
-                break
-        while True:
-            try:
-                sim_stats_intl.append(model.wv.similarity('equality','treaty'))
-                break
-            except KeyError:
-                sim_stats_intl.append('NA')
-                break
-        while True:
-            try:
-                sim_stats_german.append(model.wv.similarity('equality','german'))
-                break
-            except KeyError:
-                sim_stats_german.append('NA')
-                break
-        while True:
-            try:
-                sim_stats_race.append(model.wv.similarity('equality','race'))
-                break
-            except KeyError:
-                sim_stats_race.append('NA')
-                break
-        while True:
-            try:
-                sim_stats_afam.append(model.wv.similarity('equality','african_american'))
-                break
-            except KeyError:
-                sim_stats_afam.append('NA')
-                break
-        run = k+1
-        era = j+1
-        print("Finished with run %d out of %d for era %d." % (run, n_bootstraps, era))
-    print("*******Finished with era %d.*******" % (era))
-    gender_similarity.append(sim_stats_gender)
-    intl_similarity.append(sim_stats_intl)
-    german_similarity.append(sim_stats_german)
-    race_similarity.append(sim_stats_race)
-    afam_similarity.append(sim_stats_afam)
-
-stat_types = [gender_similarity, intl_similarity, german_similarity, 
-              race_similarity, afam_similarity]
+# The (era, replicate) models are trained in parallel; processes and threads
+# per process default to a layout picked from the number of available cores.
+# Returns the same [stat][era][replicate] structure as the old serial loop.
+# Each replicate's vectors are kept in ./bootstrap_models so
+# 05-aligned_word2vec.py can reuse them instead of training the same models
+# again. That is roughly 1,400 sets of vectors, each the era's vocabulary size
+# x 100 float32s plus the vocabulary, so the store is capped at 20 GB: past
+# that the least recently used sets are deleted (and 05 retrains those).
+# Run with --no-store to keep none.
+
+store = None if NO_STORE else default_store()
+stat_types = bootstrap_era_stats(corpus, n_bootstraps, store=store, log=log, method='naive', 
+                                 convergence=convergence, stopping=stopping, redraw=REDRAW)
 
 ## Saving model output
 
 with open('naive_model_output.pickle', 'wb') as f:
     pickle.dump(stat_types, f)
 
+# The same results as a (probe, era, replicate) array, NaN for 'NA', with the
+# epochs and seed of each replicate from the log. The .feather file has every
+# replicate in long form for R (arrow::read_feather).
+results = BootstrapResults.from_nested(stat_types, 'naive', eras, EQUALITY_PROBES.names())
+results.add_log(log)
+results.save('naive_model_output.npz')
+results.write_table('naive_replicates.feather')
+
 ## Loading model output
 
-with open('naive_model_output.pickle', 'rb') as f:
-    stat_types = pickle.load(f)
+# Either the pickle above or the .npz loads into the same BootstrapResults
+results = BootstrapResults.load('naive_model_output.pickle', 'naive', eras, EQUALITY_PROBES.names())
 
-## Finding means (and, optionally, CIs) 
+## Finding means (and, optionally, CIs)
 
-means_wCI = []
+# Every (probe, era) cell at once; n=99 keeps the first 99 non-NA replicates
+# of each cell, and size=100 is the sample size the CIs assume.
+means_wCI = [list(row) for row in results.mean(n=99)]      #Specify the number of samples to use
+# lower, upper = results.ci(z=1.95, n=99, size=100)          #Uncomment to add CIs
 
-for t in stat_types:
-    stats = []
-    for e in range(0, len(t)):
-        test = [score for score in t[e] if score != 'NA']
-        test = numpy.asarray(test)
-        test_mean = test[0:99].mean()                   #Specify the number of samples to use
-        test_error = 1.95 * (test.std()/math.sqrt(100)) #Specify the number of samples you used
-        test_ci = (test_mean - test_error, test_mean + test_error)
-        test_stats = test_mean#, test_ci                #Uncomment to add CIs
-        stats.append(test_stats)
-    means_wCI.append(stats)
-        
 ## Exporting as a .csv file for visualization in R
 
 means_wCI.insert(0, eras)
@@ -9,16 +9,36 @@ Modified on April 2 2024
 ##             word2vec            ##
 ##  Chronologically Trained Model  ##
 
-import numpy
 import pickle
 import csv
 import os
-import math
+import sys
 import random
-from gensim.models import Word2Vec
 
 random.seed(6801)
 
+## Run with --resume to pick up an interrupted run. Every finished replicate
+## is appended to data/chrono_results.jsonl;
+## replicates already logged there are skipped.
+RESUME = '--resume' in sys.argv
+
+## Run with --adaptive to stop adding replicates to an era once every probe's
+## 95% CI half-width is under 0.01 (or 100 non-NA values are in); the fixed
+## replicate count below is then only the maximum.
+ADAPTIVE = '--adaptive' in sys.argv
+
+## Run with --events to record the wall time, CPU time and peak memory of every
+## training, alignment, model load/save and stats step in
+## data/chrono_events.jsonl; with --progress, runs done and the ETA are printed
+## to stderr as the run goes.
+EVENTS = '--events' in sys.argv
+PROGRESS = '--progress' in sys.argv
+
+## Run with --converge to stop training each replicate once its loss and probe
+## similarities plateau (word2vec_functions.CONVERGENCE_PARAMS) instead of
+## always running every epoch; the epochs used are logged.
+CONVERGE = '--converge' in sys.argv
+
 ## If not using an interpreter, you can use __file__ to set the directory to the master
 dir_path = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
 
@@ -27,7 +47,11 @@ dir_path = '/Users/zhiqiangji/GitRepos/Rodman_demo/word2vec_time/word2vec_time'
 os.chdir(dir_path)
 
 os.chdir('./code')
-from word2vec_functions import chrono_train
+from word2vec_functions import chrono_train, cached_word2vec, ModelStore, CHRONO_PROBES, \
+    CONVERGENCE_PARAMS
+from corpus_functions import load_corpus, ChainedSentences
+from results_functions import ResultsLog, StoppingRule, BootstrapResults
+from instrument_functions import configure
 os.chdir('..')
 
 ############################# 
@@ -35,40 +59,31 @@ os.chdir('..')
 
 os.chdir('./data')
 eras = ['1855', '1880', '1905', '1930', '1955', '1980', '2005']
-data = []
-
-# for era in eras:
-#     path = 'processed_' + era + 'era.txt'
-#     fp = open(path)
-#     x = fp.read() 
-#     data.append(x.split('\n'))
-for era in eras:
-    path = 'processed_' + era + 'era.txt'
-    with open(path) as fp:
-        x = fp.read() 
-        data.append(x.split('\n'))
-list_of_lists = []
-    
-for i in data:
-    sentence_lists = []
-    for article in range(0, len(i)):
-        x = i[article].split()
-        sentence_lists.append(x)
-    list_of_lists.append(sentence_lists)
+
+# The era files are tokenized once into ./corpus_cache and memory-mapped on
+# later runs; the cache is rebuilt whenever a processed_<era>era.txt changes.
+corpus = load_corpus(eras)
+convergence = CONVERGENCE_PARAMS if CONVERGE else None
+log = ResultsLog('chrono_results.jsonl', resume=RESUME, 
+                 settings={'convergence': convergence})
+stopping = StoppingRule() if ADAPTIVE else None
+configure('chrono_events.jsonl' if EVENTS else None, PROGRESS)
+list_of_lists = [corpus.sentences(j) for j in range(0, len(corpus))]
     
-full_corpus = [item for sublist in list_of_lists for item in sublist]
+full_corpus = ChainedSentences(list_of_lists)
 
 ## Modeling the full corpus and saving model output
 
 #==============================================================================
-#  Note: to replicate the word2vec model results, run lines 69-139.
+#  Note: to replicate the word2vec model results, run lines 84-180.
 #  This is computationally and time intensive (2-3 hours). To replicate using
-#  model outputs from the paper, proceed to line 141 and load pickled model
+#  model outputs from the paper, proceed to line 182 and load pickled model
 #  outputs.
 #============================================================================== 
 
-start_model = Word2Vec(full_corpus, vector_size = 100, min_count = 0, epochs = 200, 
-                     sg = 1, hs = 0, negative = 5, window = 10, workers = 4)
+# The full-corpus model only depends on the corpus and hyperparameters, so it
+# is kept in ./model_cache and loaded from there on reruns until either changes.
+start_model = cached_word2vec(full_corpus, store=ModelStore('model_cache'))
 
 start_model.wv.similarity('equality','gender')
 start_model.wv.similarity('equality','treaty')
@@ -82,29 +97,47 @@ start_model.save("model1_of_fullcorpus.model")
 ## Iteratively modeling each era with previous era model
 
 # Run chrono_train function over each era to model starting with previous era, 
-# saving cosine similarity outputs
+# saving cosine similarity outputs. Eras must run in order (each one starts
+# from the model saved by the one before), but the 100 iterations within an
+# era are spread over a process pool (processes=None picks from the cores).
+# Era j's iterations are seeded from [6801, j], as in the pipeline, so every
+# run draws the same resamples.
 
 results_all = []
 
-results_1855 = chrono_train(100, list_of_lists[0], "model1_of_fullcorpus.model", "model2_of_1855.model")
+results_1855 = chrono_train(100, list_of_lists[0], "model1_of_fullcorpus.model", "model2_of_1855.model", 
+                            log=log, era=0, seed=[6801, 0], processes=None, stopping=stopping, 
+                            convergence=convergence)
 results_all.append(results_1855)
     
-results_1880 = chrono_train(100, list_of_lists[1], "model2_of_1855.model", "model3_of_1880.model")
+results_1880 = chrono_train(100, list_of_lists[1], "model2_of_1855.model", "model3_of_1880.model", 
+                            log=log, era=1, seed=[6801, 1], processes=None, stopping=stopping, 
+                            convergence=convergence)
 results_all.append(results_1880)
 
-results_1905 = chrono_train(100, list_of_lists[2], "model3_of_1880.model", "model4_of_1905.model")
+results_1905 = chrono_train(100, list_of_lists[2], "model3_of_1880.model", "model4_of_1905.model", 
+                            log=log, era=2, seed=[6801, 2], processes=None, stopping=stopping, 
+                            convergence=convergence)
 results_all.append(results_1905)
 
-results_1930 = chrono_train(100, list_of_lists[3], "model4_of_1905.model", "model5_of_1930.model")
+results_1930 = chrono_train(100, list_of_lists[3], "model4_of_1905.model", "model5_of_1930.model", 
+                            log=log, era=3, seed=[6801, 3], processes=None, stopping=stopping, 
+                            convergence=convergence)
 results_all.append(results_1930)
 
-results_1955 = chrono_train(100, list_of_lists[4], "model5_of_1930.model", "model6_of_1955.model")
+results_1955 = chrono_train(100, list_of_lists[4], "model5_of_1930.model", "model6_of_1955.model", 
+                            log=log, era=4, seed=[6801, 4], processes=None, stopping=stopping, 
+                            convergence=convergence)
 results_all.append(results_1955)
 
-results_1980 = chrono_train(100, list_of_lists[5], "model6_of_1955.model", "model7_of_1980.model")
+results_1980 = chrono_train(100, list_of_lists[5], "model6_of_1955.model", "model7_of_1980.model", 
+                            log=log, era=5, seed=[6801, 5], processes=None, stopping=stopping, 
+                            convergence=convergence)
 results_all.append(results_1980)
 
-results_2005 = chrono_train(100, list_of_lists[6], "model7_of_1980.model", "model8_of_2005.model")
+results_2005 = chrono_train(100, list_of_lists[6], "model7_of_1980.model", "model8_of_2005.model", 
+                            log=log, era=6, seed=[6801, 6], processes=None, stopping=stopping, 
+                            convergence=convergence)
 results_all.append(results_2005)
 
 # Set up the basic parameters for all loops
@@ -136,30 +169,28 @@ stat_types = [gender_similarity, intl_similarity, german_similarity,
 ## Saving model output
 
 with open('chrono_model_output_320.pickle', 'wb') as f:
-    pickle.dump(stat_types, f, protocol=pickle.HIGHEST_PROTOCOL) 
+    pickle.dump(stat_types, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+# The same results as a (probe, era, replicate) array, NaN for 'NA', with the
+# epochs and seed of each replicate from the log. The .feather file has every
+# replicate in long form for R (arrow::read_feather).
+results = BootstrapResults.from_nested(stat_types, 'chrono', eras, CHRONO_PROBES.names())
+results.add_log(log)
+results.save('chrono_model_output_320.npz')
+results.write_table('chrono_replicates.feather')
 
 ## Loading model output
 
-with open('chrono_model_output.pickle', 'rb') as f:
-    stat_types = pickle.load(f, encoding='latin1')               
-    
-print(len(stat_types)) 
-## Finding means
-
-means_wCI = []
-
-for t in stat_types:
-    stats = []
-    for e in range(0, len(t)):
-        test = [score for score in t[e] if score != 'NA']
-        test = numpy.asarray(test)
-        test_mean = test[0:99].mean()                   #Specify the number of samples to use
-        test_error = 1.95 * (test.std()/math.sqrt(100)) #Specify the number of samples you used
-        test_ci = (test_mean - test_error, test_mean + test_error)
-        test_stats = test_mean#, test_ci
-        stats.append(test_stats)
-    means_wCI.append(stats)
-   
+# Either the pickle above or the .npz loads into the same BootstrapResults
+results = BootstrapResults.load('chrono_model_output.pickle', 'chrono', eras, CHRONO_PROBES.names())
+
+## Finding means (and, optionally, CIs)
+
+# Every (probe, era) cell at once; n=99 keeps the first 99 non-NA replicates
+# of each cell, and size=100 is the sample size the CIs assume.
+means_wCI = [list(row) for row in results.mean(n=99)]      #Specify the number of samples to use
+# lower, upper = results.ci(z=1.95, n=99, size=100)          #Uncomment to add CIs
+
 ## Exporting as a .csv file for visualization in R
 
 means_wCI.insert(0, eras)
@@ -173,14 +204,9 @@ with open('chrono_mean_output.csv', 'w', newline='') as f:
 
 ## Exporting "social"-"equality" means and CIs
 
-social = []
-for e in range(0, len(stat_types[5])):
-        test = [score for score in stat_types[5][e] if score != 'NA']
-        test = numpy.asarray(test)
-        test_mean = test[0:99].mean()                   #Specify the number of samples to use
-        test_error = 1.95 * (test.std()/math.sqrt(100)) #Specify the number of samples you used
-        test_stats = (test_mean, test_mean - test_error, test_mean + test_error)
-        social.append(test_stats)
+# Adaptive eras stop at different counts, so each cell's own count is the size
+lower, upper = results.ci(z=1.95, n=99, size=None if ADAPTIVE else 100)
+social = list(zip(results.mean(n=99)[5], lower[5], upper[5]))
 
 # with open('chrono_social_output.csv', 'wb') as f:
 #         writer = csv.writer(f, delimiter=',')
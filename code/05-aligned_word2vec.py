@@ -11,14 +11,39 @@ Modified on April 2 2024
 
 import csv
 import pickle
-import numpy as np
 import os
-import math
+import sys
 import random
 from word2vec_functions import *
 
 random.seed(6801)
 
+## Run with --resume to pick up an interrupted run. Every finished replicate
+## is appended to data/aligned_results.jsonl;
+## replicates already logged there are skipped.
+RESUME = '--resume' in sys.argv
+
+## Run with --adaptive to stop adding replicates to an era once every probe's
+## 95% CI half-width is under 0.01 (or 100 non-NA values are in); the fixed
+## replicate count below is then only the maximum.
+ADAPTIVE = '--adaptive' in sys.argv
+
+## Run with --events to record the wall time, CPU time and peak memory of every
+## training, alignment, model load/save and stats step in
+## data/aligned_events.jsonl; with --progress, runs done and the ETA are printed
+## to stderr as the run goes.
+EVENTS = '--events' in sys.argv
+PROGRESS = '--progress' in sys.argv
+
+## Run with --redraw to redraw (up to 10 times) any bootstrap sample that is
+## missing a probe word, instead of recording NA for that probe.
+REDRAW = 10 if '--redraw' in sys.argv else 0
+
+## Run with --converge to stop training each replicate once its loss and probe
+## similarities plateau (word2vec_functions.CONVERGENCE_PARAMS) instead of
+## always running every epoch; the epochs used are logged.
+CONVERGE = '--converge' in sys.argv
+
 ## If not using an interpreter, you can use __file__ to set the directory to the master
 dir_path = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
 
@@ -28,6 +53,9 @@ os.chdir(dir_path)
 
 os.chdir('./code')
 import word2vec_functions
+from corpus_functions import load_corpus
+from results_functions import ResultsLog, StoppingRule, BootstrapResults
+from instrument_functions import configure
 os.chdir('..')
 
 ############################# 
@@ -35,35 +63,24 @@ os.chdir('..')
 
 os.chdir('./data')
 eras = ['1855', '1880', '1905', '1930', '1955', '1980', '2005']
-data = []
-
-# for era in eras:
-#     path = 'processed_' + era + 'era.txt'
-#     fp = open(path)
-#     x = fp.read() 
-#     data.append(x.split('\n'))
-for era in eras:
-    path = 'processed_' + era + 'era.txt'
-    with open(path) as fp:
-        x = fp.read() 
-        data.append(x.split('\n'))
-
-list_of_lists = []
-    
-for i in data:
-    sentence_lists = []
-    for article in range(0, len(i)):
-        x = i[article].split()
-        sentence_lists.append(x)
-    list_of_lists.append(sentence_lists)
+
+# The era files are tokenized once into ./corpus_cache and memory-mapped on
+# later runs; the cache is rebuilt whenever a processed_<era>era.txt changes.
+corpus = load_corpus(eras)
+convergence = word2vec_functions.CONVERGENCE_PARAMS if CONVERGE else None
+log = ResultsLog('aligned_results.jsonl', resume=RESUME, 
+                 settings={'convergence': convergence})
+stopping = StoppingRule() if ADAPTIVE else None
+configure('aligned_events.jsonl' if EVENTS else None, PROGRESS)
+list_of_lists = [corpus.sentences(j) for j in range(0, len(corpus))]
     
     
 ## Aligning the time slices and producing cosine similarity statistics    
 
 #==============================================================================
-#  Note: to replicate the word2vec model results, run lines 70-108.
+#  Note: to replicate the word2vec model results, run lines 87-139.
 #  This is computationally and time intensive (3-4 hours). To replicate using
-#  model outputs from the paper, proceed to line 110 and load pickled model
+#  model outputs from the paper, proceed to line 141 and load pickled model
 #  outputs.
 #==============================================================================      
             
@@ -71,9 +88,14 @@ iterations = 200
 
 # specifies word2vec ready sentences in list of lists of list format;
 # second input is number of iterations; output is cosine similarities for all
-# models except the first one (the basis) 
+# models except the first one (the basis). Bootstrap replicates already
+# trained by 02-naive_time_word2vec.py are read from ./bootstrap_models
+# rather than retrained, so only alignment and stats are computed for them.
 
-stats = word2vec_functions.iterate_model_stats(list_of_lists, iterations)                                              
+stats = word2vec_functions.iterate_model_stats(list_of_lists, iterations, 
+                                               store=word2vec_functions.default_store(), 
+                                               log=log, convergence=convergence, 
+                                               stopping=stopping, redraw=REDRAW)
 
 gender_similarity = []
 intl_similarity = []
@@ -87,7 +109,7 @@ for j in range(0, len(eras)-1):
     german = []
     race = []
     afam = []
-    for i in range(0, iterations):
+    for i in range(0, len(stats[j])):
         gender = gender + stats[j][i][0]
         intl = intl + stats[j][i][1]
         german = german + stats[j][i][2]
@@ -107,29 +129,29 @@ stat_types = [gender_similarity, intl_similarity, german_similarity,
 with open('aligned_model_output.pickle', 'wb') as f:
     pickle.dump(stat_types, f, protocol=pickle.HIGHEST_PROTOCOL)
 
+# The same results as a (probe, era, replicate) array, NaN for 'NA', with the
+# epochs and seed of each replicate from the log. The .feather file has every
+# replicate in long form for R (arrow::read_feather).
+results = BootstrapResults.from_nested(stat_types, 'aligned', eras[1:], 
+                                       word2vec_functions.EQUALITY_PROBES.names())
+results.add_log(log, range(1, len(eras)))
+results.save('aligned_model_output.npz')
+results.write_table('aligned_replicates.feather')
+
 ## Loading model output
 
-with open('aligned_model_output.pickle', 'rb') as f:
-    stat_types = pickle.load(f, encoding='latin1')           
-              
+# Either the pickle above or the .npz loads into the same BootstrapResults
+results = BootstrapResults.load('aligned_model_output.pickle', 'aligned', eras[1:], 
+                                word2vec_functions.EQUALITY_PROBES.names())
+
 ## Generating means and confidence intervals of cosine similarity scores for 1880-2005 eras
 # Note: not 1855, since that model is the "basis." Using scores from naive model for 1855
 # in R visualization code.
-              
-means_wCI = []
-
-for t in stat_types:
-    type_stat = []
-    for e in range(0, len(t)):
-        test = [score for score in t[e] if score != 'NA']
-        test = np.asarray(test)
-        test_mean = test[0:99].mean()                   #Specify the number of samples to use
-        test_error = 1.95 * (test.std()/math.sqrt(100)) #Specify the number of samples you used
-        test_ci = (test_mean - test_error, test_mean + test_error)
-        test_stats = test_mean#, test_ci                #Uncomment to add CIs
-        type_stat.append(test_stats)
-    means_wCI.append(type_stat)
 
+# Every (probe, era) cell at once; n=99 keeps the first 99 non-NA replicates
+# of each cell, and size=100 is the sample size the CIs assume.
+means_wCI = [list(row) for row in results.mean(n=99)]      #Specify the number of samples to use
+# lower, upper = results.ci(z=1.95, n=99, size=100)          #Uncomment to add CIs
 
 ## Exporting as a .csv file for visualization in R
 
@@ -0,0 +1,279 @@
+"""
+Timing benchmarks for the word2vec pipelines on synthetic corpora.
+
+    python -m benchmark run [--scales 1 10 100] [options]
+    python -m benchmark compare OLD.json NEW.json
+
+Run from the code folder. `run` writes synthetic processed_<era>era.txt files
+that mirror the real ones era by era (number of documents, log-normal
+document lengths, Zipf exponent of the word frequencies, vocabulary size),
+scaled up by each factor given, and times every stage of a replicate on
+them separately:
+
+    corpus_build     tokenize the era files into the binary corpus cache
+    corpus_load      map an up-to-date cache
+    resample         draw a bootstrap sample and count its vocabulary
+    train            train one replicate model (bootstrap_vectors)
+    intersect        intersection_align_gensim on two era models
+    procrustes       smart_procrustes_align_gensim on two era models
+    model_stats      produce_model_stats on one model
+    summarize        BootstrapResults means and CIs over a full run
+
+The profile is measured from the era files in --data when they are there,
+and is otherwise a built-in stand-in of about the NYT sample's size. Each
+run is written as JSON (with the commit, versions, profile and settings)
+under benchmarks/, and `compare` reports the change per stage between two
+such files, so runs from different commits can be checked for regressions.
+Training uses --epochs (default 20) instead of the 200 the replication
+uses, so the larger scales finish in reasonable time.
+"""
+
+import os
+import sys
+import json
+import time
+import copy
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+import numpy as np
+import gensim
+from word2vec_functions import bootstrap_vectors, cached_word2vec, intersection_align_gensim, \
+    smart_procrustes_align_gensim, produce_model_stats, BOOTSTRAP_PARAMS, EQUALITY_PROBES, \
+    CHRONO_PROBES
+from corpus_functions import load_corpus, build_corpus_cache, resample_sentences, era_path
+from results_functions import BootstrapResults
+
+ERAS = ['1855', '1880', '1905', '1930', '1955', '1980', '2005']
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.pardir, 'data')
+RESULTS_DIR = 'benchmarks'
+
+# Stand-in profile used when the real era files are not available: per era,
+# the number of documents, mean and sd of log document length (in tokens),
+# the vocabulary size and the Zipf exponent of the word frequencies.
+DEFAULT_PROFILE = [
+    {'era': era, 'n_docs': n_docs, 'len_mu': 5.8, 'len_sigma': 0.8, 'vocab': vocab, 'zipf': 1.05}
+    for era, n_docs, vocab in zip(ERAS, [250, 400, 450, 500, 550, 700, 650],
+                                  [12000, 16000, 17000, 18000, 19000, 22000, 21000])]
+
+# Probe words are planted at fixed frequency ranks, so the probe pairs can
+# be scored on the synthetic models much as on the real ones.
+PROBE_RANKS = dict(zip(CHRONO_PROBES.words, [60, 400, 900, 1500, 700, 2500, 350]))
+
+
+## Synthetic corpora
+
+def corpus_profile(eras, directory='.'):
+    ''' Measure the profile of the era files in directory (see        '''
+    ''' DEFAULT_PROFILE), through the binary corpus cache.            '''
+    corpus = load_corpus(eras, directory)
+    profile = []
+    for e in range(0, len(corpus)):
+        lengths = np.diff(np.asarray(corpus.offsets[e], dtype=np.int64))
+        log_lengths = np.log(np.maximum(lengths, 1))
+        counts = np.bincount(corpus.tokens[e], minlength=len(corpus.vocab))
+        counts = np.sort(counts[counts > 0])[::-1]
+        # Fit log(count) = c - s*log(rank) over the head of the distribution
+        head = min(len(counts), 10000)
+        ranks = np.arange(1, head + 1)
+        slope = np.polyfit(np.log(ranks), np.log(counts[:head]), 1)[0]
+        profile.append({'era': eras[e], 'n_docs': int(len(lengths)),
+                        'len_mu': float(log_lengths.mean()), 'len_sigma': float(log_lengths.std()),
+                        'vocab': int(len(counts)), 'zipf': float(-slope)})
+    return profile
+
+
+def _vocabulary(size):
+    ''' Word of each frequency rank (0-based): w<rank>, with the probe '''
+    ''' words at their PROBE_RANKS.                                    '''
+    words = np.array(['w%d' % r for r in range(0, size)], dtype=object)
+    for word, rank in PROBE_RANKS.items():
+        if rank < size:
+            words[rank] = word
+    return words
+
+
+def write_synthetic_corpus(profile, directory, scale=1, seed=6801, chunk_docs=2000):
+    ''' Write processed_<era>era.txt files following profile, with     '''
+    ''' scale times the documents of each era and a vocabulary grown   '''
+    ''' by sqrt(scale) (Heaps' law with exponent 1/2). Every era draws  '''
+    ''' from the same rank-to-word table, so the eras share their most  '''
+    ''' frequent words as real ones do. Returns the eras written.       '''
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    words = _vocabulary(max(int(entry['vocab'] * scale ** 0.5) for entry in profile))
+    for entry in profile:
+        vocab = int(entry['vocab'] * scale ** 0.5)
+        cdf = np.cumsum(np.arange(1, vocab + 1, dtype=np.float64) ** -entry['zipf'])
+        cdf /= cdf[-1]
+        n_docs = max(1, int(entry['n_docs'] * scale))
+        with open(era_path(entry['era'], directory), 'w', encoding='utf-8') as f:
+            for first in range(0, n_docs, chunk_docs):
+                n = min(chunk_docs, n_docs - first)
+                lengths = np.maximum(1, rng.lognormal(entry['len_mu'], entry['len_sigma'], n)
+                                     .astype(np.int64))
+                ranks = np.minimum(np.searchsorted(cdf, rng.random(int(lengths.sum()))), vocab - 1)
+                tokens = words[ranks]
+                bounds = np.concatenate([[0], np.cumsum(lengths)])
+                f.write(''.join(' '.join(tokens[bounds[d]:bounds[d+1]]) + '\n'
+                                for d in range(0, n)))
+    return [entry['era'] for entry in profile]
+
+
+## Timing
+
+def _timed(func, repeat):
+    ''' Call func() repeat times; wall and CPU seconds of each call,   '''
+    ''' and the last return value.                                      '''
+    wall = []
+    cpu = []
+    value = None
+    for i in range(0, repeat):
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        value = func()
+        wall.append(time.perf_counter() - start_wall)
+        cpu.append(time.process_time() - start_cpu)
+    return {'wall': wall, 'cpu': cpu, 'median': float(np.median(wall))}, value
+
+
+def benchmark_stages(directory, eras, repeat=3, workers=4, epochs=20, replicates=100, seed=6801):
+    ''' Time each stage on the era files in directory (see the module  '''
+    ''' docstring). Training and alignment use the era with the most   '''
+    ''' tokens and its predecessor (or successor).                     '''
+    stages = {}
+    cache_dir = os.path.join(directory, 'corpus_cache')
+
+    def build():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        return build_corpus_cache(eras, directory)
+    stages['corpus_build'], _ = _timed(build, 1)
+    stages['corpus_load'], corpus = _timed(lambda: load_corpus(eras, directory), repeat)
+
+    sizes = [len(corpus.tokens[e]) for e in range(0, len(corpus))]
+    era = int(np.argmax(sizes))
+    other = era - 1 if era > 0 else era + 1
+    sentences = corpus.sentences(era)
+    rng = np.random.default_rng(seed)
+    stages['resample'], _ = _timed(lambda: resample_sentences(sentences, rng).word_freq(), repeat)
+
+    params = dict(BOOTSTRAP_PARAMS, epochs=epochs)
+    stages['train'], _ = _timed(lambda: bootstrap_vectors(sentences, seed, workers, params=params),
+                                repeat)
+
+    models = [cached_word2vec(corpus.sentences(e), None, workers, params) for e in (other, era)]
+    copies = [[copy.deepcopy(m) for m in models] for i in range(0, repeat)]
+    stages['intersect'], _ = _timed(lambda: intersection_align_gensim(*copies.pop()), repeat)
+    copies = [[copy.deepcopy(m) for m in models] for i in range(0, repeat)]
+    stages['procrustes'], _ = _timed(lambda: smart_procrustes_align_gensim(*copies.pop()), repeat)
+    # One call takes microseconds, so time a full run's worth at once
+    stages['model_stats'], _ = _timed(lambda: [produce_model_stats(models[1], EQUALITY_PROBES)
+                                               for i in range(0, replicates)], repeat)
+
+    values = np.random.default_rng(seed).random((len(EQUALITY_PROBES), len(eras), replicates))
+    results = BootstrapResults(values, 'naive', eras, EQUALITY_PROBES.names())
+    stages['summarize'], _ = _timed(lambda: (results.mean(n=replicates - 1),
+                                             results.ci(z=1.95, n=replicates - 1,
+                                                        size=replicates)), repeat)
+    return {'stages': stages, 'train_era': eras[era], 'align_eras': [eras[other], eras[era]],
+            'tokens': sizes, 'documents': [corpus.n_docs(e) for e in range(0, len(corpus))]}
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scales, data=DATA_DIR, output=RESULTS_DIR, work=None, repeat=3, workers=4, epochs=20,
+        replicates=100, seed=6801):
+    ''' Benchmark each scale on a fresh synthetic corpus and write one  '''
+    ''' JSON file per scale to output. Returns the paths written.        '''
+    if all(os.path.exists(era_path(era, data)) for era in ERAS):
+        profile, source = corpus_profile(ERAS, data), 'measured'
+    else:
+        profile, source = DEFAULT_PROFILE, 'default'
+    commit = _commit()
+    os.makedirs(output, exist_ok=True)
+    written = []
+    for scale in scales:
+        directory = tempfile.mkdtemp(prefix='benchmark_', dir=work)
+        try:
+            eras = write_synthetic_corpus(profile, directory, scale, seed)
+            record = benchmark_stages(directory, eras, repeat, workers, epochs, replicates, seed)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        record.update({'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'scale': scale, 'profile_source': source, 'profile': profile,
+                       'settings': {'repeat': repeat, 'workers': workers, 'epochs': epochs,
+                                    'replicates': replicates, 'seed': seed},
+                       'versions': {'python': platform.python_version(),
+                                    'numpy': np.__version__, 'gensim': gensim.__version__},
+                       'machine': {'platform': platform.platform(), 'cpus': os.cpu_count()}})
+        path = os.path.join(output, 'bench_%s_%gx.json' % (commit or 'nocommit', scale))
+        with open(path, 'w') as f:
+            json.dump(record, f, indent=1)
+        for name, timing in record['stages'].items():
+            print("%6gx %-13s %10.4f s" % (scale, name, timing['median']))
+        written.append(path)
+    return written
+
+
+def compare(old_path, new_path, threshold=0.1):
+    ''' Print the median time of every stage in two benchmark files and  '''
+    ''' the relative change; returns the stages that got slower by more '''
+    ''' than threshold.                                                   '''
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    if (old['scale'], old['settings'], old['profile']) != (new['scale'], new['settings'], new['profile']):
+        print("warning: the files differ in scale, settings or profile")
+    slower = []
+    for name in new['stages']:
+        if name not in old['stages']:
+            continue
+        a, b = old['stages'][name]['median'], new['stages'][name]['median']
+        change = (b - a) / a if a > 0 else 0.0
+        flag = ''
+        if change > threshold:
+            slower.append(name)
+            flag = '  slower'
+        print("%-13s %10.4f s %10.4f s %+7.1f%%%s" % (name, a, b, 100 * change, flag))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    sub = commands.add_parser('run')
+    sub.add_argument('--scales', type=float, nargs='+', default=[1],
+                     help='corpus sizes relative to the profile (e.g. 1 10 100)')
+    sub.add_argument('--data', default=DATA_DIR, help='folder with the era files to profile')
+    sub.add_argument('--output', default=RESULTS_DIR, help='folder for the JSON results')
+    sub.add_argument('--work', default=None, help='folder for the synthetic corpora')
+    sub.add_argument('--repeat', type=int, default=3)
+    sub.add_argument('--workers', type=int, default=4, help='gensim threads')
+    sub.add_argument('--epochs', type=int, default=20)
+    sub.add_argument('--replicates', type=int, default=100)
+    sub.add_argument('--seed', type=int, default=6801)
+    sub = commands.add_parser('compare')
+    sub.add_argument('old')
+    sub.add_argument('new')
+    sub.add_argument('--threshold', type=float, default=0.1,
+                     help='relative slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        return 1 if compare(args.old, args.new, args.threshold) else 0
+    run(args.scales, args.data, args.output, args.work, args.repeat, args.workers, args.epochs,
+        args.replicates, args.seed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,810 @@
+"""
+Integer-encoded corpus used by the word2vec scripts.
+
+Each era is held as one flat uint32 array of token ids plus an offsets array
+marking where every document starts and ends, against a single vocabulary
+table shared by all eras. Worker processes attach to the arrays through
+memory-mapped .npy files instead of receiving pickled lists of strings.
+
+load_corpus() tokenizes the processed_<era>era.txt files once and keeps the
+result in a binary cache next to them, so later runs just map the arrays.
+The cache build streams the era files with buffered reads, so it never needs
+an era to fit in memory. TextEraSentences reads an era file the same lazy way
+for gensim directly; it stands alone, for use without the cache, and the
+scripts do not use it.
+
+TermIndex holds an era's document-term counts, so the vocabulary of a
+bootstrap sample (a multiset of known documents) is computed from them
+instead of by rescanning the sample's text. Read by column it is also an
+inverted index, telling which documents (and so which samples) contain a
+given word. The cache build writes each era's index alongside its arrays.
+
+WindowedCorpus expresses derived eras, such as the overlap eras of
+03-overlap_word2vec.py, as document ranges over an encoded corpus, so they
+are read from the same arrays rather than copied.
+"""
+
+import os
+import json
+import hashlib
+import shutil
+import tempfile
+from array import array
+import numpy as np
+from scipy import sparse
+
+
+class EncodedCorpus(object):
+    ''' Vocabulary table plus, for each era, a flat uint32 token-id     '''
+    ''' array and an offsets array (document d spans                    '''
+    ''' tokens[offsets[d]:offsets[d+1]]).                                '''
+
+    def __init__(self, vocab, tokens, offsets, eras=None):
+        self.vocab = list(vocab)
+        self.tokens = list(tokens)
+        self.offsets = list(offsets)
+        self.eras = list(eras) if eras is not None else [str(e) for e in range(len(self.tokens))]
+        self.words = np.asarray(self.vocab, dtype=object)
+        self.term_indexes = {}
+        self.directory = None
+        self._key_to_index = None
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def n_docs(self, era):
+        return len(self.offsets[era]) - 1
+
+    def document(self, era, doc):
+        ''' Token ids of one document. '''
+        offsets = self.offsets[era]
+        return self.tokens[era][offsets[doc]:offsets[doc+1]]
+
+    def sentences(self, era, indices=None):
+        ''' Restartable iterable of token lists for gensim, optionally   '''
+        ''' restricted to (and repeated by) the document indices given. '''
+        return CorpusSentences(self, era, indices)
+
+    def word_id(self, word):
+        ''' Vocabulary index of word, or -1 if it is not in the corpus. '''
+        if self._key_to_index is None:
+            self._key_to_index = {w: i for i, w in enumerate(self.vocab)}
+        return self._key_to_index.get(word, -1)
+
+    def term_index(self, era):
+        ''' The era's TermIndex, built on first use. '''
+        if era not in self.term_indexes:
+            self.term_indexes[era] = TermIndex.build(self.tokens[era], self.offsets[era], 
+                                                     len(self.vocab))
+        return self.term_indexes[era]
+
+    def save(self, directory):
+        ''' Write the vocabulary and the per-era arrays as .npy files.  '''
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'vocab.txt'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(self.vocab))
+        with open(os.path.join(directory, 'eras.txt'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(self.eras))
+        for e in range(0, len(self.tokens)):
+            np.save(os.path.join(directory, 'tokens_%d.npy' % e), self.tokens[e])
+            np.save(os.path.join(directory, 'offsets_%d.npy' % e), self.offsets[e])
+        for e, index in self.term_indexes.items():
+            index.save(directory, e)
+        return directory
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        ''' Attach to a saved corpus; with mmap_mode='r' the arrays are  '''
+        ''' mapped read-only and shared between processes, not copied.  '''
+        with open(os.path.join(directory, 'vocab.txt'), encoding='utf-8') as f:
+            vocab = f.read().split('\n')
+        with open(os.path.join(directory, 'eras.txt'), encoding='utf-8') as f:
+            eras = f.read().split('\n')
+        tokens = []
+        offsets = []
+        for e in range(0, len(eras)):
+            tokens.append(np.load(os.path.join(directory, 'tokens_%d.npy' % e), mmap_mode=mmap_mode))
+            offsets.append(np.load(os.path.join(directory, 'offsets_%d.npy' % e), mmap_mode=mmap_mode))
+        corpus = cls(vocab, tokens, offsets, eras)
+        corpus.directory = directory
+        for e in range(0, len(eras)):
+            index = TermIndex.load(directory, e, len(vocab), mmap_mode=mmap_mode)
+            if index is not None:
+                corpus.term_indexes[e] = index
+        return corpus
+
+    def share(self):
+        ''' A directory workers load() the corpus from. A corpus loaded  '''
+        ''' from a directory (the corpus cache) is shared as it is;     '''
+        ''' one built in memory is saved to a fresh directory in shared '''
+        ''' memory (or the temp directory where /dev/shm does not       '''
+        ''' exist). The caller releases it with unshare(). Every era's  '''
+        ''' TermIndex is built first and saved alongside if it is not   '''
+        ''' there yet, so workers map it instead of each building their '''
+        ''' own.                                                         '''
+        for e in range(0, len(self.tokens)):
+            self.term_index(e)
+        if self.directory is None:
+            return self.save(_shared_directory())
+        for e, index in self.term_indexes.items():
+            if not TermIndex.exists(self.directory, e):
+                index.save(self.directory, e)
+        return self.directory
+
+
+_shared = set()
+
+
+def _shared_directory():
+    ''' A fresh directory for share() to write to, which unshare() removes. '''
+    root = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    directory = tempfile.mkdtemp(prefix='w2v_corpus_', dir=root)
+    _shared.add(directory)
+    return directory
+
+
+def unshare(directory):
+    ''' Remove what share() wrote to `directory`; a corpus's own        '''
+    ''' directory is left alone.                                        '''
+    path = os.path.join(directory, 'windows.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            corpus = json.load(f).get('corpus')
+        if corpus is not None:
+            unshare(corpus)
+    if directory in _shared:
+        _shared.discard(directory)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class TermIndex(object):
+    ''' Document-term counts of one era as a sparse (document x word)   '''
+    ''' matrix, plus the position at which each word first occurs in   '''
+    ''' each document. Built with one sort of the era's tokens; after  '''
+    ''' that, the word counts of any multiset of its documents are a    '''
+    ''' sparse matrix-vector product.                                   '''
+
+    ARRAYS = ('indptr', 'terms', 'counts', 'first')
+
+    def __init__(self, indptr, terms, counts, first, n_words):
+        self.indptr = indptr
+        self.terms = terms
+        self.counts = counts
+        self.first = first
+        self.matrix = sparse.csr_matrix((counts, terms, indptr), shape=(len(indptr) - 1, n_words))
+        self._columns = None
+
+    @classmethod
+    def build(cls, tokens, offsets, n_words, chunk_size=1 << 22):
+        ''' Index of the era with these tokens and offsets, sorting the  '''
+        ''' documents about chunk_size tokens at a time, so the working  '''
+        ''' arrays stay that size however large the era is.              '''
+        offsets = np.asarray(offsets, dtype=np.int64)
+        n_docs = len(offsets) - 1
+        terms, counts, first = [], [], []
+        indptr = np.zeros(n_docs + 1, dtype=np.int64)
+        start = 0
+        while start < n_docs:
+            # whole documents, at least one, up to about chunk_size tokens
+            end = np.searchsorted(offsets, offsets[start] + chunk_size, side='right') - 1
+            end = min(max(end, start + 1), n_docs)
+            chunk = offsets[start:end+1]
+            docs = np.repeat(np.arange(end - start, dtype=np.int64), np.diff(chunk))
+            keys = docs * n_words + np.asarray(tokens[chunk[0]:chunk[-1]], dtype=np.int64)
+            keys, chunk_first, chunk_counts = np.unique(keys, return_index=True, 
+                                                        return_counts=True)
+            docs = keys // n_words
+            indptr[start+1:end+1] = np.bincount(docs, minlength=end - start)
+            terms.append(keys % n_words)
+            counts.append(chunk_counts.astype(np.int64))
+            first.append(chunk_first - (chunk[docs] - chunk[0]))
+            start = end
+        np.cumsum(indptr, out=indptr)
+        if not terms:
+            terms = counts = first = [np.zeros(0, dtype=np.int64)]
+        return cls(indptr, np.concatenate(terms), np.concatenate(counts), 
+                   np.concatenate(first), n_words)
+
+    @classmethod
+    def _paths(cls, directory, era):
+        return [os.path.join(directory, 'index_%d_%s.npy' % (era, name)) for name in cls.ARRAYS]
+
+    def save(self, directory, era):
+        ''' Write the arrays, each renamed into place once complete, so  '''
+        ''' a process loading the index never reads a partial one.      '''
+        for name, path in zip(self.ARRAYS, self._paths(directory, era)):
+            staging = path + '.tmp%d' % os.getpid()
+            with open(staging, 'wb') as f:
+                np.save(f, getattr(self, name))
+            os.replace(staging, path)
+
+    @classmethod
+    def exists(cls, directory, era):
+        return all(os.path.exists(path) for path in cls._paths(directory, era))
+
+    @classmethod
+    def load(cls, directory, era, n_words, mmap_mode='r'):
+        ''' The index saved for `era`, or None if there is none. '''
+        if not cls.exists(directory, era):
+            return None
+        return cls(*[np.load(path, mmap_mode=mmap_mode) for path in cls._paths(directory, era)], 
+                   n_words=n_words)
+
+    def documents(self, word_id):
+        ''' Sorted ids of the documents containing word_id (the word ->  '''
+        ''' documents side of the index, built on first use).           '''
+        if self._columns is None:
+            self._columns = self.matrix.tocsc()
+        columns = self._columns
+        return columns.indices[columns.indptr[word_id]:columns.indptr[word_id+1]]
+
+    def word_counts(self, indices):
+        ''' Count of every vocabulary word over the documents at       '''
+        ''' `indices`, repeats included.                                '''
+        weights = np.bincount(indices, minlength=self.matrix.shape[0])
+        return self.matrix.T.dot(weights)
+
+    def first_occurrences(self, indices, positions=None):
+        ''' For every (document, word) entry of the distinct documents   '''
+        ''' at `indices`: the word id, the position in `indices` where   '''
+        ''' the document is first read (mapped through `positions` if     '''
+        ''' given) and the word's first offset within the document.      '''
+        docs, position = np.unique(indices, return_index=True)
+        if positions is not None:
+            position = np.asarray(positions)[position]
+        starts = self.indptr[docs]
+        lengths = self.indptr[docs + 1] - starts
+        entries = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return self.terms[entries], np.repeat(position, lengths), self.first[entries]
+
+    def word_order(self, indices):
+        ''' Ids of the words in the documents at `indices`, in the order '''
+        ''' a pass over those documents first meets them.               '''
+        return _first_seen(*self.first_occurrences(indices))
+
+    def word_freq(self, words, indices):
+        ''' {word: count} over the documents at `indices`, keyed in the  '''
+        ''' order gensim's own vocabulary scan would insert them, so the '''
+        ''' model built from it is the same as one built by a scan.      '''
+        counts = self.word_counts(indices)
+        order = self.word_order(indices)
+        return dict(zip(words[order].tolist(), counts[order].tolist()))
+
+
+def _first_seen(words, position, first):
+    ''' Distinct words of first_occurrences() entries, ordered by where '''
+    ''' a pass over the documents first meets them.                     '''
+    order = np.lexsort((first, position))
+    words = words[order]
+    seen = np.unique(words, return_index=True)[1]
+    return words[np.sort(seen)]
+
+
+class CorpusSentences(object):
+    ''' Iterates over the documents of one era as lists of str tokens. '''
+    ''' Can be iterated any number of times, as gensim requires for    '''
+    ''' the vocabulary scan and each training epoch.                   '''
+
+    def __init__(self, corpus, era, indices=None):
+        self.corpus = corpus
+        self.era = era
+        if indices is None:
+            indices = np.arange(corpus.n_docs(era))
+        self.indices = np.asarray(indices)
+        self._fingerprint = None
+
+    def __len__(self):
+        return len(self.indices)
+
+    def subset(self, indices):
+        ''' The documents at `indices` (positions in this iterable). '''
+        return CorpusSentences(self.corpus, self.era, self.indices[indices])
+
+    def word_freq(self):
+        ''' {word: count} of these documents, from the era's TermIndex. '''
+        return self.corpus.term_index(self.era).word_freq(self.corpus.words, self.indices)
+
+    def contains(self, words):
+        ''' Bool array: whether each of words occurs in at least one of  '''
+        ''' these documents, looked up in the era's inverted index      '''
+        ''' rather than by reading the documents.                        '''
+        index = self.corpus.term_index(self.era)
+        drawn = np.zeros(self.corpus.n_docs(self.era), dtype=bool)
+        drawn[self.indices] = True
+        found = np.zeros(len(words), dtype=bool)
+        for i in range(0, len(words)):
+            word_id = self.corpus.word_id(words[i])
+            if word_id >= 0:
+                found[i] = drawn[index.documents(word_id)].any()
+        return found
+
+    def fingerprint(self):
+        ''' sentences_fingerprint() of this iterable, computed once. '''
+        if self._fingerprint is None:
+            self._fingerprint = _hash_sentences(self)
+        return self._fingerprint
+
+    def __iter__(self):
+        words = self.corpus.words
+        tokens = self.corpus.tokens[self.era]
+        offsets = self.corpus.offsets[self.era]
+        for doc in self.indices:
+            yield words[tokens[offsets[doc]:offsets[doc+1]]].tolist()
+
+
+class WindowSentences(object):
+    ''' Documents taken from several eras of an EncodedCorpus, given by  '''
+    ''' parallel arrays of era and document ids, read straight from the  '''
+    ''' era arrays like CorpusSentences (and with the same methods).    '''
+
+    def __init__(self, corpus, doc_eras, doc_ids):
+        self.corpus = corpus
+        self.doc_eras = np.asarray(doc_eras)
+        self.doc_ids = np.asarray(doc_ids)
+        self._fingerprint = None
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def subset(self, indices):
+        ''' The documents at `indices` (positions in this iterable). '''
+        return WindowSentences(self.corpus, self.doc_eras[indices], self.doc_ids[indices])
+
+    def _by_era(self):
+        ''' (era, positions in this iterable of its documents) per era. '''
+        for era in np.unique(self.doc_eras):
+            yield int(era), np.flatnonzero(self.doc_eras == era)
+
+    def word_freq(self):
+        ''' {word: count} of these documents, from the eras' TermIndexes, '''
+        ''' keyed in scan order as in TermIndex.word_freq.                '''
+        counts = np.zeros(len(self.corpus.vocab), dtype=np.int64)
+        entries = []
+        for era, positions in self._by_era():
+            index = self.corpus.term_index(era)
+            counts += index.word_counts(self.doc_ids[positions])
+            entries.append(index.first_occurrences(self.doc_ids[positions], positions))
+        order = _first_seen(*[np.concatenate(part) for part in zip(*entries)])
+        return dict(zip(self.corpus.words[order].tolist(), counts[order].tolist()))
+
+    def contains(self, words):
+        ''' As CorpusSentences.contains, over every era drawn from. '''
+        found = np.zeros(len(words), dtype=bool)
+        for era, positions in self._by_era():
+            index = self.corpus.term_index(era)
+            drawn = np.zeros(self.corpus.n_docs(era), dtype=bool)
+            drawn[self.doc_ids[positions]] = True
+            for i in range(0, len(words)):
+                word_id = self.corpus.word_id(words[i])
+                if word_id >= 0 and not found[i]:
+                    found[i] = drawn[index.documents(word_id)].any()
+        return found
+
+    def fingerprint(self):
+        ''' sentences_fingerprint() of this iterable, computed once. '''
+        if self._fingerprint is None:
+            self._fingerprint = _hash_sentences(self)
+        return self._fingerprint
+
+    def __iter__(self):
+        words = self.corpus.words
+        tokens = self.corpus.tokens
+        offsets = self.corpus.offsets
+        for era, doc in zip(self.doc_eras.tolist(), self.doc_ids.tolist()):
+            yield words[tokens[era][offsets[era][doc]:offsets[era][doc+1]]].tolist()
+
+
+def _line_offsets(path, block_size=1 << 22):
+    ''' Byte offset of the start of every line of a file, then the      '''
+    ''' file's size, scanning it in blocks. Lines end at \n, \r\n or a  '''
+    ''' lone \r, as with the universal newlines open() reads text with, '''
+    ''' and as with text.split('\n') a final line break starts one last '''
+    ''' (empty) document.                                               '''
+    starts = [np.zeros(1, dtype=np.int64)]
+    position = 0
+    with open(path, 'rb') as f:
+        block = f.read(block_size)
+        while block:
+            following = f.read(block_size)
+            data = np.frombuffer(block, dtype=np.uint8)
+            # a \r ends a line unless a \n (maybe in the next block) follows
+            after = np.append(data[1:], np.frombuffer(following[:1] or b'\0', dtype=np.uint8))
+            breaks = (data == 10) | ((data == 13) & (after != 10))
+            starts.append(np.flatnonzero(breaks).astype(np.int64) + position + 1)
+            position += len(block)
+            block = following
+    starts.append(np.array([position], dtype=np.int64))
+    return np.concatenate(starts)
+
+
+class TextEraSentences(object):
+    ''' Documents of one processed_<era>era.txt, read lazily with       '''
+    ''' buffered I/O rather than loaded whole: the same documents as    '''
+    ''' the cache build reads. Restartable for gensim\'s epochs. A      '''
+    ''' first pass records where each line starts, so bootstrap samples '''
+    ''' (subset()) seek straight to their documents. Standalone: the    '''
+    ''' scripts read the corpus cache instead.                          '''
+
+    def __init__(self, path, indices=None, line_offsets=None):
+        self.path = path
+        if line_offsets is None:
+            line_offsets = _line_offsets(path)
+        self.line_offsets = line_offsets
+        self.indices = None if indices is None else np.asarray(indices)
+        self._fingerprint = None
+
+    def __len__(self):
+        if self.indices is None:
+            return len(self.line_offsets) - 1
+        return len(self.indices)
+
+    def subset(self, indices):
+        ''' The documents at `indices` (positions in this iterable). '''
+        if self.indices is not None:
+            indices = self.indices[indices]
+        return TextEraSentences(self.path, indices, self.line_offsets)
+
+    def fingerprint(self):
+        ''' sentences_fingerprint() of this iterable, computed once. '''
+        if self._fingerprint is None:
+            self._fingerprint = _hash_sentences(self)
+        return self._fingerprint
+
+    def __iter__(self):
+        bounds = self.line_offsets
+        with open(self.path, 'rb') as f:
+            if self.indices is None:
+                # Sequential pass: plain buffered reads, no seeks
+                for doc in range(0, len(bounds) - 1):
+                    yield f.read(bounds[doc+1] - bounds[doc]).decode('utf-8').split()
+            else:
+                for doc in self.indices:
+                    f.seek(bounds[doc])
+                    yield f.read(bounds[doc+1] - bounds[doc]).decode('utf-8').split()
+
+
+class IndexedSentences(object):
+    ''' Lazy view of sentences[indices] for a plain list of token lists, '''
+    ''' so a bootstrap sample never copies the corpus.                   '''
+
+    def __init__(self, sentences, indices):
+        self.sentences = sentences
+        self.indices = np.asarray(indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __iter__(self):
+        sentences = self.sentences
+        for doc in self.indices:
+            yield sentences[doc]
+
+
+class ChainedSentences(object):
+    ''' Several sentence iterables (e.g. every era) read back to back, '''
+    ''' restartable like the parts themselves.                         '''
+
+    def __init__(self, parts):
+        self.parts = list(parts)
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+    def __iter__(self):
+        for part in self.parts:
+            for sentence in part:
+                yield sentence
+
+
+def _hash_sentences(sentences):
+    digest = hashlib.sha1()
+    for sentence in sentences:
+        digest.update((' '.join(sentence) + '\n').encode('utf-8'))
+    return digest.hexdigest()
+
+
+def sentences_fingerprint(sentences):
+    ''' sha1 of a sentence iterable's documents in order, the same     '''
+    ''' whether they come from plain lists, an encoded corpus or an    '''
+    ''' era file.                                                      '''
+    if hasattr(sentences, 'fingerprint'):
+        return sentences.fingerprint()
+    return _hash_sentences(sentences)
+
+
+def bootstrap_indices(n_docs, rng):
+    ''' Draw n_docs document indices with replacement from a          '''
+    ''' numpy.random.Generator.                                       '''
+    return rng.integers(0, n_docs, size=n_docs)
+
+
+def resample_sentences(sentences, rng):
+    ''' Bootstrap resample of a list of token lists, a CorpusSentences '''
+    ''' or a TextEraSentences, returned as a lazy view over the drawn  '''
+    ''' document indices.                                             '''
+    indices = bootstrap_indices(len(sentences), rng)
+    if hasattr(sentences, 'subset'):
+        return sentences.subset(indices)
+    return IndexedSentences(sentences, indices)
+
+
+def _encode_era(documents, key_to_index):
+    ''' Encode one era's documents (lists of str tokens) against a    '''
+    ''' growing vocabulary; returns the token-id and offsets arrays.  '''
+    ids = []
+    offsets = np.zeros(len(documents) + 1, dtype=np.int64)
+    for d in range(0, len(documents)):
+        for word in documents[d]:
+            index = key_to_index.get(word)
+            if index is None:
+                index = key_to_index[word] = len(key_to_index)
+            ids.append(index)
+        offsets[d+1] = len(ids)
+    return np.asarray(ids, dtype=np.uint32), offsets
+
+
+def encode_corpus(list_of_lists, eras=None):
+    ''' Encode a list (eras) of lists (documents) of str tokens. '''
+    key_to_index = {}
+    tokens = []
+    offsets = []
+    for era in list_of_lists:
+        era_tokens, era_offsets = _encode_era(era, key_to_index)
+        tokens.append(era_tokens)
+        offsets.append(era_offsets)
+    return EncodedCorpus(list(key_to_index), tokens, offsets, eras)
+
+
+class WindowedCorpus(object):
+    ''' Eras made up of document ranges of another corpus's eras: each  '''
+    ''' window is a list of (era, first, last) ranges, documents first   '''
+    ''' to last-1, read in that order. Nothing is copied; sentences()    '''
+    ''' reads the underlying corpus's arrays, so any number of windows   '''
+    ''' share one encoding. Stands in for an EncodedCorpus in the        '''
+    ''' bootstrap engine.                                                '''
+
+    def __init__(self, corpus, windows, eras=None):
+        self.corpus = corpus
+        self.windows = [[(int(e), int(first), int(last)) for e, first, last in window] 
+                        for window in windows]
+        if eras is None:
+            eras = corpus.eras if len(self.windows) == len(corpus) else range(len(self.windows))
+        self.eras = [str(e) for e in eras]
+        self._documents = {}
+
+    def __len__(self):
+        return len(self.windows)
+
+    def n_docs(self, j):
+        return sum(last - first for e, first, last in self.windows[j])
+
+    def documents(self, j):
+        ''' Era and document id arrays of window j. '''
+        if j not in self._documents:
+            window = self.windows[j]
+            doc_eras = [np.full(last - first, e, dtype=np.int32) for e, first, last in window]
+            doc_ids = [np.arange(first, last, dtype=np.int64) for e, first, last in window]
+            self._documents[j] = (np.concatenate(doc_eras), np.concatenate(doc_ids))
+        return self._documents[j]
+
+    def sentences(self, j, indices=None):
+        sentences = WindowSentences(self.corpus, *self.documents(j))
+        return sentences if indices is None else sentences.subset(indices)
+
+    def save(self, directory, corpus_directory=None):
+        ''' Write the windows (not the underlying corpus) to            '''
+        ''' directory/windows.json, recording where the corpus is if    '''
+        ''' corpus_directory is given.                                   '''
+        os.makedirs(directory, exist_ok=True)
+        spec = {'eras': self.eras, 'windows': self.windows}
+        if corpus_directory is not None:
+            spec['corpus'] = os.path.abspath(corpus_directory)
+        with open(os.path.join(directory, 'windows.json'), 'w') as f:
+            json.dump(spec, f)
+        return directory
+
+    @classmethod
+    def load(cls, directory, corpus=None, mmap_mode='r'):
+        ''' Windows saved in directory, over `corpus` or else the        '''
+        ''' EncodedCorpus saved with them (as share() does).             '''
+        with open(os.path.join(directory, 'windows.json')) as f:
+            spec = json.load(f)
+        if corpus is None:
+            corpus = EncodedCorpus.load(spec.get('corpus', directory), mmap_mode=mmap_mode)
+        return cls(corpus, spec['windows'], spec['eras'])
+
+    def share(self):
+        ''' Share the underlying corpus (see EncodedCorpus.share) and    '''
+        ''' save the windows, pointing at it, to a directory of their    '''
+        ''' own; workers attach() to that.                               '''
+        return self.save(_shared_directory(), self.corpus.share())
+
+
+def attach(directory, mmap_mode='r'):
+    ''' Load what share() wrote: a WindowedCorpus if there are windows, '''
+    ''' otherwise the EncodedCorpus.                                    '''
+    if os.path.exists(os.path.join(directory, 'windows.json')):
+        return WindowedCorpus.load(directory, mmap_mode=mmap_mode)
+    return EncodedCorpus.load(directory, mmap_mode=mmap_mode)
+
+
+def overlap_windows(n_docs, fraction=0.1):
+    ''' Document ranges of the overlap design of 03-overlap_word2vec.py, '''
+    ''' for eras of n_docs documents: every era also gets the first      '''
+    ''' `fraction` of the next era's documents and the last `fraction`   '''
+    ''' of the previous era's, in that order.                             '''
+    n_eras = len(n_docs)
+    windows = []
+    for j in range(0, n_eras):
+        window = [(j, 0, n_docs[j])]
+        if j < n_eras - 1:
+            window.append((j+1, 0, int(round(fraction * n_docs[j+1]))))
+        if j > 0:
+            window.append((j-1, int(round((1 - fraction) * n_docs[j-1])), n_docs[j-1]))
+        windows.append(window)
+    return windows
+
+
+def overlap_corpus(corpus, fraction=0.1):
+    ''' The overlap eras of 03-overlap_word2vec.py as a WindowedCorpus   '''
+    ''' over corpus: index ranges only, no tokens are copied.            '''
+    n_docs = [corpus.n_docs(j) for j in range(0, len(corpus))]
+    return WindowedCorpus(corpus, overlap_windows(n_docs, fraction), corpus.eras)
+
+
+def overlap_sweep_corpus(corpus, fractions):
+    ''' The overlap eras for every fraction in one WindowedCorpus:       '''
+    ''' window f * n_eras + j is era j at fractions[f].                  '''
+    n_docs = [corpus.n_docs(j) for j in range(0, len(corpus))]
+    windows = []
+    eras = []
+    for fraction in fractions:
+        windows += overlap_windows(n_docs, fraction)
+        eras += ['%s@%g' % (era, fraction) for era in corpus.eras]
+    return WindowedCorpus(corpus, windows, eras)
+
+
+## Binary corpus cache for the processed_<era>era.txt files
+
+CACHE_VERSION = 1
+
+
+def era_path(era, directory='.'):
+    return os.path.join(directory, 'processed_' + era + 'era.txt')
+
+
+def _file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _check_cache(meta, eras, directory):
+    ''' Check the cached metadata against the era files. Size and     '''
+    ''' mtime are compared first; a file whose mtime moved but whose  '''
+    ''' size is unchanged is accepted if its hash still matches, and  '''
+    ''' its new mtime is recorded. Returns (valid, meta_changed).      '''
+    if meta.get('version') != CACHE_VERSION:
+        return False, False
+    if [e['era'] for e in meta['eras']] != list(eras):
+        return False, False
+    changed = False
+    for entry in meta['eras']:
+        path = era_path(entry['era'], directory)
+        stat = os.stat(path)
+        if stat.st_size != entry['size']:
+            return False, False
+        if stat.st_mtime_ns != entry['mtime_ns']:
+            if _file_hash(path) != entry['sha1']:
+                return False, False
+            entry['mtime_ns'] = stat.st_mtime_ns
+            changed = True
+    return True, changed
+
+
+def _stream_documents(path):
+    ''' Documents of an era file as token lists, read line by line;    '''
+    ''' the same documents as fp.read().split('\n') gives, including a '''
+    ''' trailing empty one.                                            '''
+    with open(path) as fp:
+        line = ''
+        for line in fp:
+            yield line.split()
+        if line == '' or line.endswith('\n'):
+            yield []
+
+
+def _write_era(documents, key_to_index, cache_dir, e, chunk_size=1 << 20):
+    ''' Encode one era straight into tokens_<e>.npy/offsets_<e>.npy,  '''
+    ''' spilling token ids to disk in chunks so memory use does not    '''
+    ''' grow with the era. Returns (n_docs, n_tokens).                  '''
+    raw_path = os.path.join(cache_dir, 'tokens_%d.tmp' % e)
+    buffer = array('I')
+    offsets = array('q', [0])
+    n_tokens = 0
+    with open(raw_path, 'wb') as raw:
+        for document in documents:
+            for word in document:
+                index = key_to_index.get(word)
+                if index is None:
+                    index = key_to_index[word] = len(key_to_index)
+                buffer.append(index)
+            n_tokens += len(document)
+            offsets.append(n_tokens)
+            if len(buffer) >= chunk_size:
+                buffer.tofile(raw)
+                del buffer[:]
+        buffer.tofile(raw)
+    tokens = np.lib.format.open_memmap(os.path.join(cache_dir, 'tokens_%d.npy' % e), 
+                                       mode='w+', dtype=np.uint32, shape=(n_tokens,))
+    if n_tokens:
+        spilled = np.memmap(raw_path, dtype=np.uint32, mode='r')
+        for start in range(0, n_tokens, chunk_size):
+            tokens[start:start+chunk_size] = spilled[start:start+chunk_size]
+        del spilled
+    tokens.flush()
+    del tokens
+    os.remove(raw_path)
+    np.save(os.path.join(cache_dir, 'offsets_%d.npy' % e), np.frombuffer(offsets, dtype=np.int64))
+    return len(offsets) - 1, n_tokens
+
+
+def build_corpus_cache(eras, directory='.', cache_dir=None):
+    ''' Tokenize the era files (one document per line, tokens split   '''
+    ''' on whitespace, exactly as the scripts did) and write the      '''
+    ''' binary cache. Returns the cache directory.                     '''
+    if cache_dir is None:
+        cache_dir = os.path.join(directory, 'corpus_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    # Term indexes share() saved for the old era files
+    for name in os.listdir(cache_dir):
+        if name.startswith('index_'):
+            os.remove(os.path.join(cache_dir, name))
+    key_to_index = {}
+    meta = {'version': CACHE_VERSION, 'eras': []}
+    for e in range(0, len(eras)):
+        path = era_path(eras[e], directory)
+        n_docs, n_tokens = _write_era(_stream_documents(path), key_to_index, cache_dir, e)
+        # The era's TermIndex too, so runs map it rather than build it;
+        # later eras add words, but only ids the era uses shape its arrays.
+        tokens = np.load(os.path.join(cache_dir, 'tokens_%d.npy' % e), mmap_mode='r')
+        offsets = np.load(os.path.join(cache_dir, 'offsets_%d.npy' % e), mmap_mode='r')
+        TermIndex.build(tokens, offsets, len(key_to_index)).save(cache_dir, e)
+        del tokens, offsets
+        stat = os.stat(path)
+        meta['eras'].append({'era': eras[e], 'file': os.path.basename(path), 
+                             'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 
+                             'sha1': _file_hash(path), 'n_docs': n_docs, 
+                             'n_tokens': n_tokens})
+    with open(os.path.join(cache_dir, 'vocab.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(key_to_index))
+    with open(os.path.join(cache_dir, 'eras.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(eras))
+    # meta.json goes last: a cache without it is never treated as valid.
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f, indent=1)
+    return cache_dir
+
+
+def load_corpus(eras, directory='.', cache_dir=None, mmap_mode='r'):
+    ''' Load the era files as an EncodedCorpus, from the binary cache  '''
+    ''' when it is up to date and rebuilding it otherwise.            '''
+    if cache_dir is None:
+        cache_dir = os.path.join(directory, 'corpus_cache')
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    valid = False
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        valid, changed = _check_cache(meta, eras, directory)
+        if valid and changed:
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f, indent=1)
+    if not valid:
+        build_corpus_cache(eras, directory, cache_dir)
+    return EncodedCorpus.load(cache_dir, mmap_mode=mmap_mode)
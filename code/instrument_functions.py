@@ -0,0 +1,183 @@
+"""
+Timing and memory instrumentation for the word2vec pipelines.
+
+Steps wrapped in measure() or decorated with instrumented() are written as
+JSON lines to the file named by the W2V_EVENTS environment variable, one
+event per step, e.g.
+
+    {"method": "naive", "era": 3, "replicate": 17, "stage": "train",
+     "wall": 12.8, "cpu": 47.1, "rss_max": 812646400, "words": 10341207,
+     "words_per_sec": 807906.8, "epochs": 200, "pid": 4242, "time": ...}
+
+wall and cpu are seconds (cpu counts every thread of the process, so it
+exceeds wall when gensim trains on several), rss_max is the process's peak
+resident set in bytes, and words is the effective word count gensim's
+train() reports. The method, era and replicate come from the enclosing
+context() blocks. configure() sets the variable, so forked pool workers and
+pipeline stages write to the same file; each event is one append, so lines
+from different processes do not interleave. Nothing is measured while no
+file is set.
+
+Progress prints a per-method line with runs done, seconds per run and ETA to
+stderr while W2V_PROGRESS is set (configure(progress=True)).
+"""
+
+import os
+import sys
+import json
+import time
+import functools
+
+try:
+    import resource
+except ImportError:                     # not available on Windows
+    resource = None
+
+EVENTS_ENV = 'W2V_EVENTS'
+PROGRESS_ENV = 'W2V_PROGRESS'
+
+
+def configure(events=None, progress=False):
+    ''' Send events to the JSON-lines file `events` and/or turn on the  '''
+    ''' progress lines, for this process and every process it starts.  '''
+    if events is not None:
+        os.environ[EVENTS_ENV] = os.path.abspath(events)
+    if progress:
+        os.environ[PROGRESS_ENV] = '1'
+
+
+def enabled():
+    return bool(os.environ.get(EVENTS_ENV))
+
+
+def rss_max():
+    ''' Peak resident set size of this process in bytes, or None where '''
+    ''' the platform does not report it.                                '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+_context = {}
+
+
+class context(object):
+    ''' with context(method='naive', era=3, replicate=17): adds the     '''
+    ''' fields to every event emitted inside the block, including in    '''
+    ''' pool workers forked inside it.                                   '''
+
+    def __init__(self, **fields):
+        self.fields = fields
+
+    def __enter__(self):
+        self.saved = dict(_context)
+        _context.update(self.fields)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _context.clear()
+        _context.update(self.saved)
+        return False
+
+
+def _jsonable(value):
+    # numpy scalars (eras and replicates often are) and anything else
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+def emit(stage, **fields):
+    ''' Append one event to the events file, if one is set. '''
+    path = os.environ.get(EVENTS_ENV)
+    if not path:
+        return
+    event = dict(_context, stage=stage)
+    event.update(fields)
+    event.update(pid=os.getpid(), time=time.time())
+    line = (json.dumps(event, default=_jsonable) + '\n').encode('utf-8')
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+class measure(object):
+    ''' Context manager emitting the block as one `stage` event with    '''
+    ''' its wall and CPU time and the peak RSS. Fields can be added     '''
+    ''' inside the block (event['words'] = n); with words set,          '''
+    ''' words_per_sec is added too.                                      '''
+
+    def __init__(self, stage, **fields):
+        self.stage = stage
+        self.fields = fields
+
+    def __setitem__(self, name, value):
+        self.fields[name] = value
+
+    def __enter__(self):
+        self.active = enabled()
+        if self.active:
+            self.wall, self.cpu = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.active:
+            return False
+        wall = time.perf_counter() - self.wall
+        fields = dict(self.fields, wall=wall, cpu=time.process_time() - self.cpu,
+                      rss_max=rss_max())
+        if fields.get('words') is not None and wall > 0:
+            fields['words_per_sec'] = fields['words'] / wall
+        if exc_type is not None:
+            fields['error'] = exc_type.__name__
+        emit(self.stage, **fields)
+        return False
+
+
+def instrumented(stage):
+    ''' Decorator measuring every call of a function as a `stage` event. '''
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            with measure(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class Progress(object):
+    ''' Runs done out of `total` for one method. While W2V_PROGRESS is  '''
+    ''' set, advance() prints the count, the seconds per run and the    '''
+    ''' ETA to stderr, at most once every `interval` seconds.           '''
+
+    def __init__(self, method, total, interval=10):
+        self.method = method
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.start = time.time()
+        self.printed = 0
+
+    def skip(self, n):
+        ''' Drop n runs that will not happen (an era stopped early). '''
+        self.total = max(self.done, self.total - n)
+
+    def advance(self, n=1):
+        self.done += n
+        self.total = max(self.total, self.done)
+        if not os.environ.get(PROGRESS_ENV):
+            return
+        now = time.time()
+        if now - self.printed < self.interval and self.done < self.total:
+            return
+        self.printed = now
+        per_run = (now - self.start) / self.done
+        eta = per_run * (self.total - self.done)
+        sys.stderr.write("[%s] %d/%d runs, %.1f s/run, ETA %d:%02d:%02d\n"
+                         % (self.method, self.done, self.total, per_run,
+                            eta // 3600, eta % 3600 // 60, eta % 60))
+        sys.stderr.flush()
@@ -0,0 +1,520 @@
+"""
+Single entry point for the word2vec pipelines of scripts 02-05.
+
+    python -m pipeline run [target ...] [options]
+    python -m pipeline status [target ...] [options]
+
+Run from the code folder. The work is split into cached stages that form a
+DAG:
+
+    corpus --> overlap_corpus --> overlap --> export_overlap
+       |------------------------> naive ----> export_naive
+       |                            '-------> aligned --> export_aligned
+       '------------------------> chrono ---> export_chrono
+
+Targets are stage names or methods (naive, overlap, chrono, aligned, each
+meaning its export stage); the default is every method. A stage runs only
+when its key (a hash of its parameters and the keys of its inputs) differs
+from the one recorded in data/pipeline/<stage>.json, or its outputs are
+gone. The corpus stage always checks the era files, and its key is their
+hash, so editing an era file reruns everything below it and nothing else.
+Stages whose inputs are ready run at the same time, each in its own
+process with a share of the cores; aligned waits for naive so it can reuse
+naive's replicate models from data/bootstrap_models.
+
+To split the work across machines sharing the data folder instead:
+
+    python -m pipeline manifest --shards N [methods] [options]
+    python -m pipeline shard K          (on each machine, K = 0..N-1)
+    python -m pipeline merge
+
+See shard_functions for how the sharded results stay reproducible.
+
+    python -m pipeline sweep-overlap [--fractions 0 0.05 ... 0.3] [options]
+
+runs the overlap method at several overlap fractions in one pool (see
+word2vec_functions.overlap_sweep) and writes the results of each fraction
+to data/overlap_sweep/, and
+
+    python -m pipeline sweep-params --grid window=5,10 vector_size=50,100 [--random N]
+
+runs the naive bootstrap under every (or N random) combination of the given
+hyperparameters, the rest kept at BOOTSTRAP_PARAMS (see sweep_functions),
+writing to data/param_sweep/.
+"""
+
+import os
+import csv
+import sys
+import json
+import pickle
+import hashlib
+import argparse
+import multiprocessing
+from multiprocessing.connection import wait
+from word2vec_functions import bootstrap_era_stats, chrono_era_stats, iterate_model_stats, \
+    overlap_sweep, ModelStore, default_store, BOOTSTRAP_PARAMS, EQUALITY_PROBES, CHRONO_PROBES, \
+    CONVERGENCE_PARAMS
+from corpus_functions import load_corpus, overlap_corpus, WindowedCorpus
+from results_functions import ResultsLog, StoppingRule, BootstrapResults
+from shard_functions import write_manifest, run_shard, merge
+from instrument_functions import configure
+from sweep_functions import param_grid, param_samples, hyperparameter_sweep, save_configs, \
+    read_configs, sweep_results
+
+ERAS = ['1855', '1880', '1905', '1930', '1955', '1980', '2005']
+METHODS = ['naive', 'overlap', 'chrono', 'aligned']
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.pardir, 'data')
+STATE_DIR = 'pipeline'
+MANIFEST = os.path.join(STATE_DIR, 'jobs.json')
+SWEEP_DIR = 'overlap_sweep'
+PARAM_SWEEP_DIR = 'param_sweep'
+
+
+class Stage(object):
+    ''' One node of the DAG: `run(config)` is called with the data     '''
+    ''' folder as working directory and writes `outputs` (paths there). '''
+    ''' `params(config)` are the settings its result depends on.        '''
+    ''' A volatile stage always runs and returns its own key.           '''
+
+    def __init__(self, name, deps, run, params=None, outputs=(), volatile=False):
+        self.name = name
+        self.deps = list(deps)
+        self.run = run
+        self.params = params if params is not None else (lambda config: {})
+        self.outputs = list(outputs)
+        self.volatile = volatile
+
+    def key(self, config, dep_keys):
+        spec = {'stage': self.name, 'params': self.params(config),
+                'deps': [dep_keys[dep] for dep in self.deps]}
+        return hashlib.sha1(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _manifest_path(name):
+    return os.path.join(STATE_DIR, name + '.json')
+
+
+def _read_manifest(name):
+    try:
+        with open(_manifest_path(name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(name, key):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    staging = _manifest_path(name) + '.tmp'
+    with open(staging, 'w') as f:
+        json.dump({'key': key}, f)
+    os.replace(staging, _manifest_path(name))
+
+
+## Stages
+
+def _run_corpus(config):
+    ''' Build or validate the binary corpus cache; the key is the hash '''
+    ''' of the era files it was built from.                            '''
+    load_corpus(config['eras'])
+    with open(os.path.join('corpus_cache', 'meta.json')) as f:
+        meta = json.load(f)
+    hashes = [entry['sha1'] for entry in meta['eras']]
+    return hashlib.sha1(json.dumps(hashes).encode('utf-8')).hexdigest()
+
+
+def _run_overlap_corpus(config):
+    ''' Record the overlap eras as document ranges over the corpus      '''
+    ''' cache (see corpus_functions.WindowedCorpus).                    '''
+    corpus = load_corpus(config['eras'])
+    overlap_corpus(corpus, config['overlap']).save(os.path.join(STATE_DIR, 'overlap_corpus'))
+
+
+def _stats_params(method):
+    def params(config):
+        spec = {'n': config['replicates'][method], 'seed': config['seed'],
+                'model': BOOTSTRAP_PARAMS, 'adaptive': config['adaptive'],
+                'redraw': config['redraw'], 'convergence': config['convergence']}
+        if method == 'overlap':
+            spec['overlap'] = config['overlap']
+        return spec
+    return params
+
+
+def _run_stats(method):
+    def run(config):
+        eras = config['eras']
+        n = config['replicates'][method]
+        convergence = config['convergence']
+        log = ResultsLog(method + '_results.jsonl', resume=config['resume'],
+                         settings={'convergence': convergence})
+        stopping = StoppingRule() if config['adaptive'] else None
+        processes = config['processes']
+        era_keys = None
+        if method == 'overlap':
+            corpus = WindowedCorpus.load(os.path.join(STATE_DIR, 'overlap_corpus'),
+                                         load_corpus(eras))
+        else:
+            corpus = load_corpus(eras)
+        if method in ('naive', 'overlap'):
+            probes = EQUALITY_PROBES
+            store = default_store() if method == 'naive' else None
+            stat_types = bootstrap_era_stats(corpus, n, processes=processes, seed=config['seed'],
+                                             store=store, log=log, method=method,
+                                             convergence=convergence, stopping=stopping,
+                                             redraw=config['redraw'])
+        elif method == 'chrono':
+            probes = CHRONO_PROBES
+            stat_types = chrono_era_stats(corpus, n, seed=config['seed'],
+                                          store=ModelStore('model_cache'), log=log,
+                                          processes=processes, convergence=convergence,
+                                          stopping=stopping)
+        else:
+            probes = EQUALITY_PROBES
+            eras = eras[1:]
+            era_keys = range(1, len(config['eras']))
+            sentences = [corpus.sentences(j) for j in range(0, len(corpus))]
+            stats = iterate_model_stats(sentences, n, seed=config['seed'],
+                                        store=default_store(), log=log,
+                                        convergence=convergence, stopping=stopping,
+                                        redraw=config['redraw'])
+            stat_types = [[[iteration[p][0] for iteration in era] for era in stats]
+                          for p in range(0, len(probes))]
+        log.close()
+        with open(method + '_model_output.pickle', 'wb') as f:
+            pickle.dump(stat_types, f, protocol=pickle.HIGHEST_PROTOCOL)
+        results = BootstrapResults.from_nested(stat_types, method, eras, probes.names())
+        results.add_log(log, era_keys)
+        results.save(method + '_model_output.npz')
+    return run
+
+
+def _run_export(method):
+    def run(config):
+        results = BootstrapResults.load(method + '_model_output.npz')
+        means_wCI = [list(row) for row in results.mean(n=99)]
+        means_wCI.insert(0, results.eras)
+        with open(method + '_mean_output.csv', 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f, delimiter=',').writerows(means_wCI)
+        if method == 'chrono':
+            # Adaptive eras stop at different counts, so each cell's own count is the size
+            lower, upper = results.ci(z=1.95, n=99, size=None if config['adaptive'] else 100)
+            social = list(zip(results.mean(n=99)[5], lower[5], upper[5]))
+            with open('chrono_social_output.csv', 'w', newline='') as f:
+                csv.writer(f, delimiter=',').writerows(social)
+        results.write_table(method + '_replicates.feather')
+    return run
+
+
+def build_stages():
+    ''' The pipeline DAG, in a topological order. '''
+    stages = [Stage('corpus', [], _run_corpus, volatile=True),
+              Stage('overlap_corpus', ['corpus'], _run_overlap_corpus,
+                    lambda config: {'overlap': config['overlap']},
+                    [os.path.join(STATE_DIR, 'overlap_corpus', 'windows.json')])]
+    for method in METHODS:
+        deps = ['overlap_corpus'] if method == 'overlap' else ['corpus']
+        if method == 'aligned':
+            deps.append('naive')
+        stages.append(Stage(method, deps, _run_stats(method), _stats_params(method),
+                            [method + '_model_output.npz', method + '_model_output.pickle']))
+        outputs = [method + '_mean_output.csv', method + '_replicates.feather']
+        if method == 'chrono':
+            outputs.append('chrono_social_output.csv')
+        stages.append(Stage('export_' + method, [method], _run_export(method), outputs=outputs))
+    return dict((stage.name, stage) for stage in stages)
+
+
+def sweep_overlap(config, fractions):
+    ''' Run overlap_sweep over the fractions and write, per fraction,     '''
+    ''' overlap_sweep/<fraction>_model_output.npz and                     '''
+    ''' <fraction>_replicates.feather, plus the means of every fraction   '''
+    ''' and era in overlap_sweep/means.csv.                                '''
+    os.makedirs(SWEEP_DIR, exist_ok=True)
+    eras = config['eras']
+    corpus = load_corpus(eras)
+    log = ResultsLog(os.path.join(SWEEP_DIR, 'results.jsonl'),
+                     settings={'convergence': config['convergence']})
+    stopping = StoppingRule() if config['adaptive'] else None
+    stats = overlap_sweep(corpus, fractions, config['bootstraps'],
+                          processes=config['processes'], seed=config['seed'], log=log,
+                          convergence=config['convergence'], stopping=stopping,
+                          redraw=config['redraw'])
+    log.close()
+    rows = [['fraction', 'probe'] + eras]
+    for f in range(0, len(fractions)):
+        results = BootstrapResults.from_nested(stats[fractions[f]], 'overlap_sweep', eras,
+                                               EQUALITY_PROBES.names())
+        results.add_log(log, range(f * len(eras), (f + 1) * len(eras)))
+        name = os.path.join(SWEEP_DIR, '%g' % fractions[f])
+        results.save(name + '_model_output.npz')
+        results.write_table(name + '_replicates.feather')
+        means = results.mean()
+        for p in range(0, len(results.probes)):
+            rows.append(['%g' % fractions[f], results.probes[p]] + list(means[p]))
+    with open(os.path.join(SWEEP_DIR, 'means.csv'), 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f, delimiter=',').writerows(rows)
+
+
+def _parse_space(specs):
+    ''' {name: [values]} from name=v1,v2,... arguments; values are read  '''
+    ''' as JSON (numbers) where possible.                                 '''
+    space = {}
+    for spec in specs:
+        name, sep, values = spec.partition('=')
+        if not sep or not values:
+            raise SystemExit("expected name=value[,value...], got %r" % spec)
+        space[name] = []
+        for value in values.split(','):
+            try:
+                space[name].append(json.loads(value))
+            except ValueError:
+                space[name].append(value)
+    return space
+
+
+def sweep_params(config, space, n_random=None, use_store=False):
+    ''' Run hyperparameter_sweep over the grid of space (or n_random     '''
+    ''' configs drawn from it) and write param_sweep/configs.json, the   '''
+    ''' streamed results.jsonl, <config>_model_output.npz and             '''
+    ''' <config>_replicates.feather per config, and means.csv.            '''
+    os.makedirs(PARAM_SWEEP_DIR, exist_ok=True)
+    eras = config['eras']
+    try:
+        configs = param_grid(space) if n_random is None else \
+            param_samples(space, n_random, config['seed'])
+    except ValueError as error:
+        raise SystemExit(str(error))
+    configs_path = os.path.join(PARAM_SWEEP_DIR, 'configs.json')
+    # The log's era numbers only mean something for the same configs
+    resume = config['resume'] and read_configs(configs_path) == configs
+    save_configs(configs_path, configs)
+    log = ResultsLog(os.path.join(PARAM_SWEEP_DIR, 'results.jsonl'), resume=resume,
+                     settings={'convergence': config['convergence']})
+    stopping = StoppingRule() if config['adaptive'] else None
+    store = default_store() if use_store else None
+    stats = hyperparameter_sweep(load_corpus(eras), configs, config['bootstraps'],
+                                 processes=config['processes'], seed=config['seed'], store=store,
+                                 log=log, stopping=stopping, redraw=config['redraw'],
+                                 convergence=config['convergence'])
+    log.close()
+    names = sorted(space)
+    rows = [['config'] + names + ['probe'] + eras]
+    for c, results in enumerate(sweep_results(stats, configs, eras, log)):
+        results.save(os.path.join(PARAM_SWEEP_DIR, '%d_model_output.npz' % c))
+        results.write_table(os.path.join(PARAM_SWEEP_DIR, '%d_replicates.feather' % c))
+        means = results.mean()
+        for p in range(0, len(results.probes)):
+            rows.append([c] + [configs[c][name] for name in names] + [results.probes[p]]
+                        + list(means[p]))
+    with open(os.path.join(PARAM_SWEEP_DIR, 'means.csv'), 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f, delimiter=',').writerows(rows)
+
+
+## Scheduling
+
+def _needed(stages, targets):
+    ''' Names of the targets and everything they depend on, in DAG order. '''
+    needed = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(stages[name].deps)
+    return [name for name in stages if name in needed]
+
+
+def _up_to_date(stage, key):
+    manifest = _read_manifest(stage.name)
+    return (manifest is not None and manifest['key'] == key
+            and all(os.path.exists(path) for path in stage.outputs))
+
+
+def _stage_process(stage, config, key):
+    new_key = stage.run(config)
+    _write_manifest(stage.name, new_key if stage.volatile else key)
+
+
+def run(stages, targets, config, jobs, force=False):
+    ''' Run the stages the targets need, at most `jobs` at a time, each  '''
+    ''' in its own process. Returns False if a stage failed.             '''
+    order = _needed(stages, targets)
+    keys = {}
+    running = {}
+    processes = {}
+    failed = []
+    context = multiprocessing.get_context('fork') \
+        if 'fork' in multiprocessing.get_all_start_methods() else multiprocessing.get_context()
+    while True:
+        for name in order:
+            stage = stages[name]
+            if failed or name in keys or name in processes or len(running) >= jobs:
+                continue
+            if not all(dep in keys for dep in stage.deps):
+                continue
+            key = stage.key(config, keys)
+            if not force and not stage.volatile and _up_to_date(stage, key):
+                keys[name] = key
+                print("%s: up to date" % name)
+                continue
+            print("%s: running" % name)
+            process = context.Process(target=_stage_process, args=(stage, config, key), name=name)
+            process.start()
+            running[process.sentinel] = name
+            processes[name] = process
+        if not running:
+            break
+        for sentinel in wait(list(running)):
+            name = running.pop(sentinel)
+            process = processes[name]
+            process.join()
+            if process.exitcode != 0:
+                print("%s: failed (exit code %s)" % (name, process.exitcode))
+                failed.append(name)
+            else:
+                keys[name] = _read_manifest(name)['key']
+                print("%s: done" % name)
+    return not failed
+
+
+def status(stages, targets, config):
+    ''' Print which of the stages the targets need would rerun. Stages  '''
+    ''' below a volatile or outdated stage can only be known to be       '''
+    ''' current once it has run, so they are reported as unknown.       '''
+    keys = {}
+    for name in _needed(stages, targets):
+        stage = stages[name]
+        if stage.volatile:
+            manifest = _read_manifest(name)
+            keys[name] = manifest['key'] if manifest else None
+            print("%s: checked on every run" % name)
+        elif any(keys.get(dep) is None for dep in stage.deps):
+            keys[name] = None
+            print("%s: unknown until its inputs run" % name)
+        else:
+            key = stage.key(config, keys)
+            current = _up_to_date(stage, key)
+            keys[name] = key if current else None
+            print("%s: %s" % (name, 'up to date' if current else 'will run'))
+
+
+def _targets(stages, names):
+    if not names:
+        names = METHODS
+    targets = []
+    for name in names:
+        if name in METHODS:
+            name = 'export_' + name
+        if name not in stages:
+            raise SystemExit("unknown target %r (stages: %s)" % (name, ', '.join(stages)))
+        targets.append(name)
+    return targets
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pipeline', description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    sweeps = ('sweep-overlap', 'sweep-params')
+    for command in ('run', 'status', 'manifest', 'shard', 'merge') + sweeps:
+        sub = commands.add_parser(command)
+        sub.add_argument('--data', default=DATA_DIR, help='folder with the processed era files')
+        if command in ('run', 'shard') + sweeps:
+            sub.add_argument('--events', default=None,
+                             help='write timing and memory events to this JSON-lines file')
+            sub.add_argument('--progress', action='store_true',
+                             help='print runs done and ETA per method to stderr')
+        if command == 'shard':
+            sub.add_argument('shard', type=int, help='shard to run (0-based)')
+            sub.add_argument('--processes', type=int, default=None)
+            sub.add_argument('--wait', type=int, default=600,
+                             help='seconds to wait for models other shards publish')
+        if command in ('shard', 'merge'):
+            continue
+        sub.add_argument('--seed', type=int, default=6801)
+        sub.add_argument('--bootstraps', type=int, default=200,
+                         help='replicates per era for naive, overlap and aligned')
+        if command not in sweeps:
+            sub.add_argument('targets', nargs='*', help='stages or methods (default: all methods)')
+            sub.add_argument('--iterations', type=int, default=100, help='chrono iterations per era')
+            sub.add_argument('--overlap', type=float, default=0.1,
+                             help='share of each neighbouring era added by the overlap method')
+        if command == 'manifest':
+            sub.add_argument('--shards', type=int, required=True)
+            continue
+        if command == 'sweep-overlap':
+            sub.add_argument('--fractions', type=float, nargs='+',
+                             default=[0, 0.05, 0.1, 0.15, 0.2, 0.25, 0.3],
+                             help='overlap fractions to run')
+        if command == 'sweep-params':
+            sub.add_argument('--grid', nargs='+', required=True, metavar='NAME=V1,V2',
+                             help='Word2Vec parameters and the values to try')
+            sub.add_argument('--random', type=int, default=None, metavar='N',
+                             help='run N configs drawn from the grid instead of all of it')
+            sub.add_argument('--store', action='store_true',
+                             help='keep replicates in (and reuse them from) bootstrap_models')
+            sub.add_argument('--resume', action='store_true',
+                             help='keep replicates already logged for the same configs')
+        if command in sweeps:
+            sub.add_argument('--processes', type=int, default=None)
+        sub.add_argument('--adaptive', action='store_true',
+                         help='stop each era once its CIs are narrow enough')
+        sub.add_argument('--redraw', action='store_true',
+                         help='redraw samples that miss a probe word')
+        sub.add_argument('--converge', action='store_true',
+                         help='stop training each replicate once it plateaus')
+        if command == 'run':
+            sub.add_argument('--jobs', type=int, default=3, help='stages run at the same time')
+            sub.add_argument('--resume', action='store_true',
+                             help='keep replicates already in the results logs')
+            sub.add_argument('--force', action='store_true', help='rerun even up-to-date stages')
+    args = parser.parse_args(argv)
+
+    if args.command in ('run', 'shard') + sweeps:
+        configure(args.events, args.progress)
+    os.chdir(args.data)
+    if args.command == 'shard':
+        run_shard(MANIFEST, args.shard, processes=args.processes, wait=args.wait)
+        return 0
+    if args.command == 'merge':
+        for path in merge(MANIFEST):
+            print("wrote %s" % path)
+        return 0
+    if args.command in sweeps:
+        config = {'eras': ERAS, 'seed': args.seed, 'adaptive': args.adaptive,
+                  'redraw': 10 if args.redraw else 0, 'bootstraps': args.bootstraps,
+                  'processes': args.processes,
+                  'convergence': CONVERGENCE_PARAMS if args.converge else None}
+        if args.command == 'sweep-overlap':
+            sweep_overlap(config, args.fractions)
+        else:
+            config['resume'] = args.resume
+            sweep_params(config, _parse_space(args.grid), args.random, args.store)
+        return 0
+    replicates = {'naive': args.bootstraps, 'overlap': args.bootstraps,
+                  'aligned': args.bootstraps, 'chrono': args.iterations}
+    if args.command == 'manifest':
+        methods = args.targets or METHODS
+        os.makedirs(STATE_DIR, exist_ok=True)
+        manifest = write_manifest(MANIFEST, ERAS, dict((m, replicates[m]) for m in methods),
+                                  args.shards, args.seed, args.overlap)
+        print("wrote %s: %d jobs over %d shards" % (MANIFEST, len(manifest['jobs']), args.shards))
+        return 0
+
+    config = {'eras': ERAS, 'seed': args.seed, 'overlap': args.overlap,
+              'adaptive': args.adaptive, 'redraw': 10 if args.redraw else 0,
+              'convergence': CONVERGENCE_PARAMS if args.converge else None,
+              'replicates': replicates}
+    stages = build_stages()
+    targets = _targets(stages, args.targets)
+    if args.command == 'status':
+        status(stages, targets, config)
+        return 0
+    config['resume'] = args.resume
+    # Concurrent stages split the cores between their process pools.
+    config['processes'] = max(1, (os.cpu_count() or 1) // max(1, args.jobs))
+    return 0 if run(stages, targets, config, max(1, args.jobs), args.force) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,356 @@
+"""
+Bookkeeping for bootstrap results produced by the word2vec scripts.
+
+ResultsLog appends every finished (method, era, replicate) result to a
+JSON-lines file as soon as it exists, so a crashed or interrupted run can be
+picked up again with --resume instead of starting over.
+
+BootstrapResults holds a finished run as one (probe, era, replicate) float
+array with NaN for 'NA', reduces it to means, CIs and percentiles for every
+cell at once, and stores it as .npz. Older pickled outputs load into it too.
+write_table() exports every replicate in long form as Feather or Parquet
+(needs pyarrow) for R to read without going through Python.
+"""
+
+import os
+import json
+import pickle
+import zipfile
+import warnings
+import numpy as np
+
+
+class ResultsLog(object):
+    ''' Append-only, fsync'd log of finished replicates. One JSON object '''
+    ''' per line: {"method", "era", "replicate", "stats"} plus "epochs"  '''
+    ''' and "seed" when known, with null for the 'NA' entries. Without   '''
+    ''' resume a new log is started, and a non-empty existing one is     '''
+    ''' moved aside to <path>.<n>.bak rather than cleared. `settings`    '''
+    ''' (a JSON-able dict, e.g. the early-stopping settings) is recorded '''
+    ''' on the first line; resuming a log recorded with other settings   '''
+    ''' raises ValueError, so replicates of different runs never mix.    '''
+
+    def __init__(self, path, resume=False, settings=None):
+        self.path = path
+        self.results = {}
+        self.epochs = {}
+        self.seeds = {}
+        # normalized as it reads back (tuples become lists)
+        self.settings = json.loads(json.dumps(settings))
+        if resume and os.path.exists(path):
+            logged = self._read()
+            if logged != self.settings and (logged is not None or self.results):
+                raise ValueError("%s was written with settings %s, not %s; run without "
+                                 "resuming to start it over" % (path, logged, self.settings))
+            header = logged is None and not self.results and self.settings is not None
+        else:
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                backup = _backup_path(path)
+                os.replace(path, backup)
+                print("Moved the existing %s to %s; pass --resume to continue a log "
+                      "instead." % (path, backup))
+            open(path, 'w').close()
+            header = self.settings is not None
+        self._file = open(path, 'a')
+        if header:
+            self._write({'settings': self.settings})
+
+    def _read(self):
+        ''' Load the logged replicates; returns the recorded settings.  '''
+        settings = None
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        # A run killed mid-write can leave a torn last line; cut it off so
+        # new entries start on a clean line.
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            with open(self.path, 'r+b') as f:
+                f.truncate(end)
+        for line in data[:end].decode('utf-8').splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if 'settings' in entry:
+                settings = entry['settings']
+                continue
+            stats = ['NA' if s is None else np.float32(s) for s in entry['stats']]
+            key = (entry['method'], entry['era'], entry['replicate'])
+            self.results[key] = stats
+            if entry.get('epochs') is not None:
+                self.epochs[key] = entry['epochs']
+            if entry.get('seed') is not None:
+                self.seeds[key] = entry['seed']
+        return settings
+
+    def get(self, method, era, replicate):
+        ''' Logged stats of a replicate, or None if it has not run. '''
+        return self.results.get((method, era, replicate))
+
+    def append(self, method, era, replicate, stats, epochs=None, seed=None):
+        ''' Record a finished replicate; `epochs` is the number of       '''
+        ''' training epochs it used and `seed` the seed its resample    '''
+        ''' was drawn with, if known.                                    '''
+        entry = {'method': method, 'era': era, 'replicate': replicate,
+                 'stats': [None if s == 'NA' else float(s) for s in stats]}
+        if epochs is not None:
+            entry['epochs'] = int(epochs)
+            self.epochs[(method, era, replicate)] = int(epochs)
+        if seed is not None:
+            entry['seed'] = int(seed)
+            self.seeds[(method, era, replicate)] = int(seed)
+        self._write(entry)
+        self.results[(method, era, replicate)] = list(stats)
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def _backup_path(path):
+    ''' The first of <path>.1.bak, <path>.2.bak, ... not taken yet. '''
+    n = 1
+    while os.path.exists('%s.%d.bak' % (path, n)):
+        n += 1
+    return '%s.%d.bak' % (path, n)
+
+
+## Sequential (adaptive) bootstrap
+
+class OnlineStats(object):
+    ''' Running count, mean and variance (Welford) of each probe's     '''
+    ''' similarity over the replicates of one era, skipping 'NA'; n    '''
+    ''' counts the replicates themselves, 'NA' or not.                 '''
+
+    def __init__(self, n_probes):
+        self.n = 0
+        self.count = np.zeros(n_probes, dtype=np.int64)
+        self.mean = np.zeros(n_probes)
+        self.m2 = np.zeros(n_probes)
+
+    def update(self, stats):
+        self.n += 1
+        for p in range(0, len(stats)):
+            if stats[p] == 'NA':
+                continue
+            self.count[p] += 1
+            delta = float(stats[p]) - self.mean[p]
+            self.mean[p] += delta / self.count[p]
+            self.m2[p] += delta * (float(stats[p]) - self.mean[p])
+
+    def std(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sqrt(self.m2 / self.count)
+
+    def half_width(self, z=1.95):
+        ''' CI half-width z * std / sqrt(n), as the scripts compute it; '''
+        ''' inf for probes with fewer than two samples.                  '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            width = z * self.std() / np.sqrt(self.count)
+        width[self.count < 2] = np.inf
+        return width
+
+
+class StoppingRule(object):
+    ''' When to stop launching replicates for an era: every probe has   '''
+    ''' either at least min_samples non-NA values and a CI half-width   '''
+    ''' at or below half_width, or `enough` non-NA values outright.    '''
+    ''' A probe that has been 'NA' in all of at least min_samples       '''
+    ''' replicates (a word missing from the era) counts as settled,    '''
+    ''' since more replicates will not give it a value either. The     '''
+    ''' pipelines' own replicate count stays the upper bound.           '''
+
+    def __init__(self, half_width=0.01, min_samples=20, enough=100, z=1.95):
+        self.half_width = half_width
+        self.min_samples = min_samples
+        self.enough = enough
+        self.z = z
+
+    def satisfied(self, online):
+        narrow = (online.count >= self.min_samples) & (online.half_width(self.z) <= self.half_width)
+        absent = (online.count == 0) & (online.n >= self.min_samples)
+        return bool(np.all(narrow | absent | (online.count >= self.enough)))
+
+
+## Results arrays
+
+class BootstrapResults(object):
+    ''' Similarities of a finished run as a dense float32 array of shape '''
+    ''' (probe, era, replicate), NaN where a replicate gave 'NA' or did  '''
+    ''' not run (eras may have different replicate counts), plus the    '''
+    ''' method, era labels and probe names. epochs and seeds, when      '''
+    ''' known, are (era, replicate) int64 arrays with -1 for unknown.   '''
+
+    def __init__(self, values, method=None, eras=None, probes=None, epochs=None, seeds=None):
+        self.values = np.asarray(values, dtype=np.float32)
+        self.method = method
+        self.eras = None if eras is None else [str(e) for e in eras]
+        self.probes = None if probes is None else list(probes)
+        self.epochs = None if epochs is None else np.asarray(epochs, dtype=np.int64)
+        self.seeds = None if seeds is None else np.asarray(seeds, dtype=np.int64)
+
+    @classmethod
+    def from_nested(cls, stat_types, method=None, eras=None, probes=None):
+        ''' From the [stat][era][replicate] lists the pipelines return, '''
+        ''' with 'NA' (or None) for missing values.                     '''
+        n_eras = max(len(t) for t in stat_types)
+        n_replicates = max(len(era) for t in stat_types for era in t)
+        values = np.full((len(stat_types), n_eras, n_replicates), np.nan, dtype=np.float32)
+        for s in range(0, len(stat_types)):
+            for e in range(0, len(stat_types[s])):
+                scores = stat_types[s][e]
+                values[s, e, :len(scores)] = [np.nan if x is None or x == 'NA' else x for x in scores]
+        return cls(values, method, eras, probes)
+
+    @classmethod
+    def load(cls, path, method=None, eras=None, probes=None):
+        ''' Load a .npz written by save(), or any other path as one of   '''
+        ''' the pickled [stat][era][replicate] outputs (the metadata is   '''
+        ''' then taken from the arguments).                              '''
+        if path.endswith('.npz'):
+            with np.load(path) as data:
+                meta = json.loads(str(data['meta']))
+                return cls(data['values'], meta['method'], meta['eras'], meta['probes'], 
+                           data['epochs'] if 'epochs' in data else None, 
+                           data['seeds'] if 'seeds' in data else None)
+        with open(path, 'rb') as f:
+            stat_types = pickle.load(f, encoding='latin1')
+        return cls.from_nested(stat_types, method, eras, probes)
+
+    def save(self, path):
+        meta = {'method': self.method, 'eras': self.eras, 'probes': self.probes}
+        arrays = {'values': self.values, 'meta': json.dumps(meta)}
+        if self.epochs is not None:
+            arrays['epochs'] = self.epochs
+        if self.seeds is not None:
+            arrays['seeds'] = self.seeds
+        # Written by hand rather than with np.savez_compressed so that
+        # the zip entries carry a fixed timestamp: equal results give a
+        # byte-identical file.
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, value in arrays.items():
+                info = zipfile.ZipInfo(name + '.npy', date_time=(1980, 1, 1, 0, 0, 0))
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with archive.open(info, 'w', force_zip64=True) as f:
+                    np.lib.format.write_array(f, np.asanyarray(value), allow_pickle=False)
+
+    def add_log(self, log, era_keys=None):
+        ''' Fill in epochs and seeds from a ResultsLog of this method.  '''
+        ''' era_keys are the eras the log uses for this array's eras,   '''
+        ''' by default 0, 1, 2, ...                                      '''
+        n_eras, n_replicates = self.values.shape[1:]
+        if era_keys is None:
+            era_keys = range(n_eras)
+        self.epochs = np.full((n_eras, n_replicates), -1, dtype=np.int64)
+        self.seeds = np.full((n_eras, n_replicates), -1, dtype=np.int64)
+        for e, era in enumerate(era_keys):
+            for r in range(0, n_replicates):
+                key = (self.method, era, r)
+                self.epochs[e, r] = log.epochs.get(key, -1)
+                self.seeds[e, r] = log.seeds.get(key, -1)
+        return self
+
+    def ran(self):
+        ''' (era, replicate) bool array of replicates that ran: those   '''
+        ''' up to the last one with any value, epochs or seed known.    '''
+        known = ~np.isnan(self.values).all(axis=0)
+        for extra in (self.epochs, self.seeds):
+            if extra is not None:
+                known |= extra >= 0
+        last = np.where(known.any(axis=1), known.shape[1] - np.argmax(known[:, ::-1], axis=1), 0)
+        return np.arange(known.shape[1]) < last[:, None]
+
+    def write_table(self, path):
+        ''' Write every replicate that ran in long form, one row per    '''
+        ''' (probe, era, replicate): method, era, probe, replicate,     '''
+        ''' similarity, epochs, seed, with nulls for NA and unknowns.   '''
+        ''' A .parquet path writes Parquet; anything else an            '''
+        ''' uncompressed Feather (Arrow IPC) file, which R's            '''
+        ''' arrow::read_feather() can memory-map. Requires pyarrow.     '''
+        import pyarrow
+        n_probes, n_eras = self.values.shape[:2]
+        probes = self.probes if self.probes is not None else [str(p) for p in range(n_probes)]
+        eras = self.eras if self.eras is not None else [str(e) for e in range(n_eras)]
+        probe, era, replicate = np.nonzero(np.broadcast_to(self.ran(), self.values.shape))
+        similarity = self.values[probe, era, replicate]
+
+        columns = {
+            'method': pyarrow.array([self.method] * len(probe), pyarrow.string()).dictionary_encode(),
+            'era': pyarrow.DictionaryArray.from_arrays(era.astype(np.int32), eras),
+            'probe': pyarrow.DictionaryArray.from_arrays(probe.astype(np.int32), probes),
+            'replicate': pyarrow.array(replicate.astype(np.int32)),
+            'similarity': pyarrow.array(similarity, mask=np.isnan(similarity)),
+        }
+        for name, extra in (('epochs', self.epochs), ('seed', self.seeds)):
+            if extra is None:
+                columns[name] = pyarrow.nulls(len(probe), pyarrow.int64())
+            else:
+                values = extra[era, replicate]
+                columns[name] = pyarrow.array(values, mask=values < 0)
+        table = pyarrow.table(columns)
+        if path.endswith('.parquet'):
+            import pyarrow.parquet
+            pyarrow.parquet.write_table(table, path)
+        else:
+            import pyarrow.feather
+            pyarrow.feather.write_feather(table, path, compression='uncompressed')
+        return path
+
+    def to_nested(self):
+        ''' Back to [stat][era][replicate] lists with 'NA'. Trailing    '''
+        ''' replicates that are NA for every probe are left off, as    '''
+        ''' they cannot be told apart from ones that never ran.        '''
+        ran = ~np.isnan(self.values).all(axis=0)
+        nested = []
+        for s in range(0, self.values.shape[0]):
+            eras = []
+            for e in range(0, self.values.shape[1]):
+                n = np.flatnonzero(ran[e]).max() + 1 if ran[e].any() else 0
+                eras.append(['NA' if np.isnan(x) else x for x in self.values[s, e, :n]])
+            nested.append(eras)
+        return nested
+
+    def count(self):
+        ''' Non-NA replicates per (probe, era). '''
+        return (~np.isnan(self.values)).sum(axis=2)
+
+    def first(self, n):
+        ''' Copy of values keeping only each cell's first n non-NA     '''
+        ''' replicates (the scripts' test[0:n]).                       '''
+        valid = ~np.isnan(self.values)
+        return np.where(valid & (np.cumsum(valid, axis=2) <= n), self.values, np.nan)
+
+    def mean(self, n=None):
+        ''' Mean of every cell, over its first n non-NA replicates or  '''
+        ''' all of them. NaN for cells without any.                   '''
+        values = self.values if n is None else self.first(n)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanmean(values.astype(np.float64), axis=2).astype(np.float32)
+
+    def std(self):
+        ''' Population std of every cell's non-NA replicates. '''
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanstd(self.values.astype(np.float64), axis=2).astype(np.float32)
+
+    def ci(self, z=1.95, n=None, size=None):
+        ''' (lower, upper) arrays of mean(n) -/+ z * std / sqrt(size),   '''
+        ''' size defaulting to each cell's non-NA count. The scripts use '''
+        ''' n=99, size=100 (size=None in adaptive runs).                 '''
+        if size is None:
+            size = self.count()
+        error = (z * self.std() / np.sqrt(size)).astype(np.float32)
+        mean = self.mean(n)
+        return mean - error, mean + error
+
+    def percentile(self, q):
+        ''' nanpercentile of every cell; q may be a scalar or a list,   '''
+        ''' which adds a leading axis.                                  '''
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanpercentile(self.values, q, axis=2)
@@ -0,0 +1,377 @@
+"""
+Job manifests for running the word2vec pipelines as independent jobs.
+
+A manifest lists every (method, era, replicate) job with a seed derived from
+one root seed, and assigns each job to a shard. Shards can run on separate
+machines against a shared data folder: each finished job is written to its
+own small JSON file under pipeline/shards/, and merge() assembles those into
+the usual outputs. The seed, the resample and the gensim model seed of a job
+depend only on the job, and shards train with a single gensim thread (gensim's
+multi-threaded training is not reproducible), so the merged files are
+byte-identical however the jobs were sharded. For the same reason shards keep
+their replicates in a store of their own, pipeline/shards/store/, never in
+bootstrap_models, where the scripts store multi-threaded models under the
+same keys.
+
+The full models jobs start from are trained once, by 'model' jobs that
+publish them under pipeline/shards/models/: the whole-corpus model chrono's
+first era starts from (era -1 in the manifest) and each era's model, the
+alignment bases of aligned. Chrono jobs of later eras start from the model
+the previous era's iteration 0 saved. Those iteration-0 jobs form a chain
+that is dealt to shard 0 with the whole-corpus model, and a shard only
+starts a job once the models it starts from are there: it runs
+everything else meanwhile, and when nothing is left but jobs waiting on
+another shard's models it waits for them for a while, then stops (rerun it
+to finish them).
+"""
+
+import os
+import json
+import time
+import queue
+import shutil
+import tempfile
+import numpy as np
+from gensim.models import Word2Vec
+from word2vec_functions import bootstrap_vectors, align_and_produce_new_model, \
+    smart_procrustes_align_gensim, cached_word2vec, with_na, AlignmentBase, ModelSnapshot, \
+    ModelStore, BOOTSTRAP_PARAMS, EQUALITY_PROBES, CHRONO_PROBES, _chrono_iteration, \
+    _process_pool
+from corpus_functions import load_corpus, overlap_corpus, ChainedSentences
+from results_functions import BootstrapResults
+from instrument_functions import measure, context, Progress
+
+METHODS = ['naive', 'overlap', 'chrono', 'aligned']
+METHOD_PROBES = {'naive': EQUALITY_PROBES, 'overlap': EQUALITY_PROBES,
+                 'aligned': EQUALITY_PROBES, 'chrono': CHRONO_PROBES}
+
+# naive, overlap and aligned draw from the same seed stream as
+# replicate_seed(), so aligned jobs reuse naive's stored replicates;
+# chrono iterations get a stream of their own.
+CHRONO_STREAM = 1
+
+
+def job_seed(root, method, era, replicate):
+    ''' Seed of one (method, era, replicate) job, derived from root. '''
+    entropy = [root, era, replicate]
+    if method == 'chrono':
+        entropy.append(CHRONO_STREAM)
+    return int(np.random.SeedSequence(entropy).generate_state(1)[0])
+
+
+def write_manifest(path, eras, replicates, n_shards, root_seed=6801, overlap=0.1):
+    ''' Write the job manifest: every job of every method in           '''
+    ''' `replicates` ({method: count per era}) with its seed, dealt out '''
+    ''' round-robin over n_shards shards, after the model jobs training '''
+    ''' the full models they start from, except the chrono chain (the   '''
+    ''' whole-corpus model and iteration 0 of every era), which shard 0 '''
+    ''' runs. Aligned jobs cover eras 1..n-1, as in iterate_model_stats. '''
+    ''' The corpus cache is built here, so shards started together only '''
+    ''' ever read it.                                                    '''
+    load_corpus(eras)
+    models = []
+    if 'chrono' in replicates:
+        models.append(-1)
+    if 'aligned' in replicates:
+        models += list(range(0, len(eras) - 1))
+    jobs = [{'method': 'model', 'era': era, 'replicate': 0} for era in models]
+    for method in METHODS:
+        if method not in replicates:
+            continue
+        first = 1 if method == 'aligned' else 0
+        for era in range(first, len(eras)):
+            for replicate in range(0, replicates[method]):
+                jobs.append({'method': method, 'era': era, 'replicate': replicate,
+                             'seed': job_seed(root_seed, method, era, replicate)})
+    dealt = 0
+    for job in jobs:
+        if _chrono_chain(job):
+            job['shard'] = 0
+        else:
+            job['shard'] = dealt % n_shards
+            dealt += 1
+    manifest = {'root_seed': root_seed, 'eras': list(eras), 'overlap': overlap,
+                'params': BOOTSTRAP_PARAMS, 'shards': n_shards,
+                'replicates': replicates, 'jobs': jobs}
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def _chrono_chain(job):
+    ''' Whether job is a link of the chrono chain: the whole-corpus    '''
+    ''' model or iteration 0 of an era.                                 '''
+    if job['method'] == 'model':
+        return job['era'] < 0
+    return job['method'] == 'chrono' and job['replicate'] == 0
+
+
+def read_manifest(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _result_path(results_dir, job):
+    if job['method'] == 'model':
+        return os.path.join(_model_dir(results_dir, job['era']), 'model.w2v')
+    return os.path.join(results_dir, job['method'], '%d_%d.json' % (job['era'], job['replicate']))
+
+
+def _model_dir(results_dir, era):
+    ''' Where the model job of era `era` (-1: the whole corpus)        '''
+    ''' publishes its model.                                            '''
+    return os.path.join(results_dir, 'models', 'all' if era < 0 else str(era))
+
+
+def _chrono_model_dir(results_dir, era):
+    return os.path.join(results_dir, 'chrono_models', str(era))
+
+
+def _needs(results_dir, job):
+    ''' Paths of the models other jobs publish that `job` starts from. '''
+    method, era = job['method'], job['era']
+    if method == 'chrono':
+        if era == 0:
+            return [_result_path(results_dir, {'method': 'model', 'era': -1})]
+        return [os.path.join(_chrono_model_dir(results_dir, era - 1), 'model.w2v')]
+    if method == 'aligned':
+        return [_result_path(results_dir, {'method': 'model', 'era': base})
+                for base in range(max(era - 2, 0), era)]
+    return []
+
+
+def _publish(staging, final):
+    ''' Rename a finished staging directory to `final`, so other      '''
+    ''' shards never see a partial entry.                             '''
+    os.makedirs(os.path.dirname(final), exist_ok=True)
+    try:
+        os.rename(staging, final)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+## Shard workers
+
+_shard = None
+
+
+def _init_shard_worker(manifest, results_dir):
+    global _shard
+    corpus = load_corpus(manifest['eras'])
+    _shard = {'manifest': manifest, 'results_dir': results_dir, 'corpus': corpus,
+              'overlap': None, 'store': ModelStore(os.path.join(results_dir, 'store')),
+              'bases': {}, 'snapshots': {}}
+
+
+def _load_model(era):
+    ''' The model the model job of era `era` published. '''
+    return Word2Vec.load(_result_path(_shard['results_dir'], {'method': 'model', 'era': era}),
+                         mmap='r')
+
+
+def _sentences(method):
+    if method == 'overlap':
+        if _shard['overlap'] is None:
+            _shard['overlap'] = overlap_corpus(_shard['corpus'], _shard['manifest']['overlap'])
+        corpus = _shard['overlap']
+    else:
+        corpus = _shard['corpus']
+    return [corpus.sentences(j) for j in range(0, len(corpus))]
+
+
+def _chrono_snapshot(era):
+    ''' The model era `era` starts from: the whole-corpus model for era '''
+    ''' 0, else the one the previous era's iteration 0 published.       '''
+    if era not in _shard['snapshots']:
+        if era == 0:
+            _shard['snapshots'][era] = ModelSnapshot(_load_model(-1))
+        else:
+            path = os.path.join(_chrono_model_dir(_shard['results_dir'], era - 1), 'model.w2v')
+            _shard['snapshots'][era] = ModelSnapshot(path, mmap='r')
+    return _shard['snapshots'][era]
+
+
+def _alignment_base(era):
+    ''' The base aligned era `era` (1..n-1) is aligned to, as in        '''
+    ''' iterate_model_stats, built from the published era models: the   '''
+    ''' model of era 0 for era 1, otherwise the model of era-1          '''
+    ''' Procrustes-aligned to the model of era-2.                       '''
+    if era not in _shard['bases']:
+        if era == 1:
+            base = AlignmentBase(_load_model(0))
+        else:
+            base = AlignmentBase(smart_procrustes_align_gensim(_load_model(era - 2),
+                                                               _load_model(era - 1)))
+        _shard['bases'][era] = base
+    return _shard['bases'][era]
+
+
+def _train_model(job):
+    ''' Train the full model of a model job once and publish it (the   '''
+    ''' published model is its cache, so no store is consulted).        '''
+    if job['era'] < 0:
+        sentences = ChainedSentences(_sentences('chrono'))
+    else:
+        sentences = _sentences('aligned')[job['era']]
+    model = cached_word2vec(sentences, None, 1, _shard['manifest']['params'])
+    staging = tempfile.mkdtemp(dir=_shard['results_dir'], prefix='.tmp_')
+    with measure('model_save', kind='model'):
+        model.save(os.path.join(staging, 'model.w2v'), sep_limit=0)
+    _publish(staging, _model_dir(_shard['results_dir'], job['era']))
+    return job
+
+
+def _run_job(job):
+    ''' Run one job and write its result file. '''
+    with context(method=job['method'], era=job['era'], replicate=job['replicate']):
+        return _run_job_in_context(job)
+
+
+def _run_job_in_context(job):
+    if job['method'] == 'model':
+        return _train_model(job)
+    method, era, seed = job['method'], job['era'], job['seed']
+    manifest = _shard['manifest']
+    results_dir = _shard['results_dir']
+    store = _shard['store']
+    probes = METHOD_PROBES[method]
+    # The gensim seed comes from the job too, so replicates do not all
+    # start from the same initial vectors.
+    params = dict(manifest['params'], seed=seed)
+    sentences = _sentences(method)
+    epochs = None
+    if method in ('naive', 'overlap'):
+        wv = bootstrap_vectors(sentences[era], seed, workers=1, store=store, params=params,
+                               probes=probes)
+        stats = ['NA'] * len(probes) if wv is None else with_na(probes.similarities(wv))
+        epochs = None if wv is None else wv.epochs_used
+    elif method == 'aligned':
+        wv = align_and_produce_new_model(_alignment_base(era), sentences[era], seed=seed,
+                                         store=store, probes=probes, params=params, workers=1)
+        stats = ['NA'] * len(probes) if wv is None else with_na(probes.similarities(wv))
+        epochs = None if wv is None else wv.epochs_used
+    else:
+        snapshot = _chrono_snapshot(era)
+        final = _chrono_model_dir(results_dir, era)
+        if job['replicate'] == 0 and not os.path.isdir(final):
+            staging = tempfile.mkdtemp(dir=results_dir, prefix='.tmp_')
+            stats, epochs = _chrono_iteration(snapshot, sentences[era], seed, probes,
+                                              os.path.join(staging, 'model.w2v'), 1)
+            _publish(staging, final)
+        else:
+            stats, epochs = _chrono_iteration(snapshot, sentences[era], seed, probes, threads=1)
+    result = {'stats': [None if s == 'NA' else float(s) for s in stats],
+              'epochs': None if epochs is None else int(epochs), 'seed': seed}
+    path = _result_path(results_dir, job)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp%d' % os.getpid(), 'w') as f:
+        json.dump(result, f)
+    os.replace(path + '.tmp%d' % os.getpid(), path)
+    return job
+
+
+def _schedule_ready(pool, jobs, results_dir, window, wait, poll):
+    ''' Run jobs on pool in order, but each only once the model it    '''
+    ''' needs is published, keeping at most `window` in flight, and   '''
+    ''' yield them as they finish. Returns with the jobs still        '''
+    ''' waiting once nothing has run for `wait` seconds.              '''
+    finished = queue.Queue()
+    pending = list(jobs)
+    in_flight = 0
+    idle_since = None
+    while pending or in_flight:
+        for job in list(pending):
+            if in_flight >= window:
+                break
+            if all(os.path.exists(path) for path in _needs(results_dir, job)):
+                pending.remove(job)
+                pool.submit(_run_job, job).add_done_callback(finished.put)
+                in_flight += 1
+        if in_flight == 0:
+            if idle_since is None:
+                idle_since = time.time()
+                print("%d jobs wait for models from other shards" % len(pending))
+            if time.time() - idle_since >= wait:
+                return
+            time.sleep(poll)
+            continue
+        idle_since = None
+        try:
+            future = finished.get(timeout=poll)
+        except queue.Empty:
+            continue
+        in_flight -= 1
+        # raises the job's exception, or BrokenProcessPool if its worker died
+        yield future.result()
+
+
+def run_shard(manifest_path, shard=None, results_dir=os.path.join('pipeline', 'shards'),
+              processes=None, wait=600, poll=5):
+    ''' Run the jobs of one shard (all jobs if shard is None) that have '''
+    ''' no result file yet, over a pool of single-threaded workers.      '''
+    ''' A job that starts from a model another shard publishes runs once '''
+    ''' the model is there; jobs still waiting after `wait` idle seconds '''
+    ''' are left undone. Rerunning a shard picks up where it stopped.     '''
+    manifest = read_manifest(manifest_path)
+    os.makedirs(results_dir, exist_ok=True)
+    jobs = [job for job in manifest['jobs'] if (shard is None or job['shard'] == shard)
+            and not os.path.exists(_result_path(results_dir, job))]
+    if not jobs:
+        return 0
+    # The chrono chain first, in era order, as every later chrono job
+    # waits on it, then the other models that jobs start from.
+    jobs.sort(key=lambda job: (not _chrono_chain(job), job['method'] != 'model', job['era']))
+    processes = min(len(jobs), processes or os.cpu_count() or 1)
+    # Bring the corpus cache up to date before the workers load it.
+    load_corpus(manifest['eras'])
+    done = 0
+    progress = Progress('shard %s' % ('all' if shard is None else shard), len(jobs))
+    with _process_pool(processes, _init_shard_worker, (manifest, results_dir)) as pool:
+        for job in _schedule_ready(pool, jobs, results_dir, processes, wait, poll):
+            done += 1
+            print("Finished %s era %d replicate %d (%d of %d)"
+                  % (job['method'], job['era'], job['replicate'], done, len(jobs)))
+            progress.advance()
+    if done < len(jobs):
+        print("Stopped with %d jobs still waiting for models from other shards; "
+              "rerun this shard once those are published." % (len(jobs) - done))
+    return done
+
+
+def merge(manifest_path, results_dir=os.path.join('pipeline', 'shards')):
+    ''' Assemble the job results of every method in the manifest into  '''
+    ''' <method>_model_output.npz and <method>_replicates.feather. Jobs  '''
+    ''' are placed by (era, replicate), never by the order they ran in, '''
+    ''' so the files do not depend on the sharding. Raises RuntimeError '''
+    ''' if any job has no result yet.                                   '''
+    manifest = read_manifest(manifest_path)
+    missing = [job for job in manifest['jobs']
+               if not os.path.exists(_result_path(results_dir, job))]
+    if missing:
+        raise RuntimeError("%d of %d jobs have no result yet (e.g. %s era %d replicate %d)"
+                           % (len(missing), len(manifest['jobs']), missing[0]['method'],
+                              missing[0]['era'], missing[0]['replicate']))
+    eras = manifest['eras']
+    written = []
+    for method in METHODS:
+        jobs = [job for job in manifest['jobs'] if job['method'] == method]
+        if not jobs:
+            continue
+        first = 1 if method == 'aligned' else 0
+        probes = METHOD_PROBES[method]
+        shape = (len(probes), len(eras) - first, manifest['replicates'][method])
+        values = np.full(shape, np.nan, dtype=np.float32)
+        epochs = np.full(shape[1:], -1, dtype=np.int64)
+        seeds = np.full(shape[1:], -1, dtype=np.int64)
+        for job in jobs:
+            with open(_result_path(results_dir, job)) as f:
+                result = json.load(f)
+            e, r = job['era'] - first, job['replicate']
+            values[:, e, r] = [np.nan if s is None else s for s in result['stats']]
+            epochs[e, r] = -1 if result['epochs'] is None else result['epochs']
+            seeds[e, r] = result['seed']
+        results = BootstrapResults(values, method, eras[first:], probes.names(), epochs, seeds)
+        results.save(method + '_model_output.npz')
+        results.write_table(method + '_replicates.feather')
+        written += [method + '_model_output.npz', method + '_replicates.feather']
+    return written
@@ -0,0 +1,97 @@
+"""
+Hyperparameter sensitivity sweeps for the naive bootstrap.
+
+A sweep trains the naive replicates of every era under each of a list of
+hyperparameter configs (variations of BOOTSTRAP_PARAMS built by
+model_params), as one job list over one process pool: every config x era is
+a window over the shared encoded corpus, so the corpus and the eras'
+TermIndex vocabulary tables are built and mapped once for all of them.
+Replicate k of an era draws the same resample under every config (and in the
+naive run), so configs are compared on common resamples, and with the
+bootstrap_models store the replicates of the default config are the naive
+run's own.
+
+Results stream into a ResultsLog as replicates finish, under era
+c * n_eras + j for config c and era j; the configs are saved next to it so
+the log can be read back (and a run resumed).
+"""
+
+import os
+import json
+import itertools
+import numpy as np
+from word2vec_functions import bootstrap_era_stats, model_params, EQUALITY_PROBES
+from corpus_functions import WindowedCorpus
+from results_functions import BootstrapResults
+
+
+def param_grid(space):
+    ''' Every combination of the values in space ({name: [values]}), as '''
+    ''' model_params() configs, in a fixed order.                       '''
+    names = sorted(space)
+    return [model_params(**dict(zip(names, values)))
+            for values in itertools.product(*[space[name] for name in names])]
+
+
+def param_samples(space, n, seed=6801):
+    ''' n distinct configs drawn at random from the grid of space       '''
+    ''' (all of it if the grid has n or fewer points).                  '''
+    grid = param_grid(space)
+    if n >= len(grid):
+        return grid
+    rng = np.random.default_rng(seed)
+    return [grid[i] for i in sorted(rng.choice(len(grid), size=n, replace=False))]
+
+
+def sweep_corpus(corpus, n_configs):
+    ''' Every era of corpus once per config, as one WindowedCorpus       '''
+    ''' (window c * n_eras + j is era j under config c).                 '''
+    windows = []
+    eras = []
+    for c in range(0, n_configs):
+        windows += [[(j, 0, corpus.n_docs(j))] for j in range(0, len(corpus))]
+        eras += ['%s#%d' % (era, c) for era in corpus.eras]
+    return WindowedCorpus(corpus, windows, eras)
+
+
+def hyperparameter_sweep(corpus, configs, n_bootstraps, processes=None, threads=None, seed=6801,
+                         probes=EQUALITY_PROBES, store=None, log=None, method='param_sweep',
+                         stopping=None, redraw=0, convergence=None):
+    ''' Bootstrap every era of the EncodedCorpus n_bootstraps times under '''
+    ''' each config, scheduling all (config, era, replicate) jobs         '''
+    ''' together. Returns one [stat][era][replicate] list per config.     '''
+    ''' `convergence` turns on early stopping (see bootstrap_vectors).    '''
+    n_eras = len(corpus)
+    windows = sweep_corpus(corpus, len(configs))
+    stat_types = bootstrap_era_stats(windows, n_bootstraps, processes, threads, seed, probes,
+                                     store, log, method, convergence=convergence,
+                                     stopping=stopping, redraw=redraw,
+                                     seed_eras=[j % n_eras for j in range(0, len(windows))],
+                                     params=[configs[j // n_eras] for j in range(0, len(windows))])
+    return [[stat[c * n_eras:(c + 1) * n_eras] for stat in stat_types]
+            for c in range(0, len(configs))]
+
+
+def save_configs(path, configs):
+    with open(path, 'w') as f:
+        json.dump(configs, f, indent=1, sort_keys=True)
+
+
+def read_configs(path):
+    ''' The configs saved at path, or None if there are none. '''
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def sweep_results(stats, configs, eras, log=None, method='param_sweep', probes=EQUALITY_PROBES):
+    ''' BootstrapResults of each config from hyperparameter_sweep's       '''
+    ''' output, with epochs and seeds filled in from the log if given.    '''
+    results = []
+    for c in range(0, len(configs)):
+        result = BootstrapResults.from_nested(stats[c], method, eras, probes.names())
+        if log is not None:
+            result.add_log(log, range(c * len(eras), (c + 1) * len(eras)))
+        results.append(result)
+    return results
@@ -7,11 +7,45 @@ Modified on April 2 2024
 """
 
 import gensim
+import os
 import copy
+import json
+import queue
+import shutil
+import hashlib
+import inspect
+import tempfile
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
 import numpy as np
-from gensim.models import Word2Vec
-from sklearn.utils import resample
+from gensim.models import Word2Vec, KeyedVectors
+from gensim.models.callbacks import CallbackAny2Vec
+from corpus_functions import EncodedCorpus, WindowedCorpus, ChainedSentences, encode_corpus, \
+    unshare, attach, resample_sentences, sentences_fingerprint, overlap_sweep_corpus
+from results_functions import OnlineStats
+from instrument_functions import measure, context, instrumented, Progress
 
+# Hyperparameters of every model the pipelines train (the replicates of all
+# four methods and the era and full-corpus models). Every engine takes a
+# `params` dict defaulting to these; model_params() builds variations.
+BOOTSTRAP_PARAMS = dict(vector_size = 100, min_count = 0, epochs = 200, 
+                        sg = 1, hs = 0, negative = 5, window = 10)
+
+_WORD2VEC_ARGS = set(inspect.signature(Word2Vec.__init__).parameters) - \
+    set(['self', 'sentences', 'corpus_file', 'corpus_iterable', 'workers', 'callbacks'])
+
+
+def model_params(**overrides):
+    ''' BOOTSTRAP_PARAMS with some values replaced. Raises ValueError   '''
+    ''' for names Word2Vec does not take, so a typo in a sweep fails     '''
+    ''' before anything is trained.                                     '''
+    unknown = sorted(set(overrides) - _WORD2VEC_ARGS)
+    if unknown:
+        raise ValueError("not Word2Vec parameters: %s" % ', '.join(unknown))
+    return dict(BOOTSTRAP_PARAMS, **overrides)
+
+
+@instrumented('intersect')
 def intersection_align_gensim(m1, m2, words=None):
     """
     Intersect two gensim word2vec models, m1 and m2.
@@ -26,47 +60,49 @@ def intersection_align_gensim(m1, m2, words=None):
     """
 
     # Get the vocab for each model
-    vocab_m1 = set(m1.wv.key_to_index.keys())    # update for Gensim 4
-    vocab_m2 = set(m2.wv.key_to_index.keys())
+    vocab_m1 = m1.wv.key_to_index    # update for Gensim 4
+    vocab_m2 = m2.wv.key_to_index
 
-    # Find the common vocabulary
-    common_vocab = vocab_m1 & vocab_m2
+    # Find the common vocabulary (dict membership keeps this linear)
+    common_vocab = [w for w in m1.wv.index_to_key if w in vocab_m2]
     if words:
-        common_vocab &= set(words)
+        words = set(words)
+        common_vocab = [w for w in common_vocab if w in words]
 
-    # If no alignment necessary because vocab is identical...
-    if not vocab_m1 - common_vocab and not vocab_m2 - common_vocab:
+    # If no alignment necessary because vocab and order are identical...
+    if len(common_vocab) == len(vocab_m1) == len(vocab_m2) and m1.wv.index_to_key == m2.wv.index_to_key:
         return m1, m2
 
     # Otherwise sort by frequency (summed for both)
-    common_vocab = list(common_vocab)
-    common_vocab.sort(key=lambda w: m1.wv.get_vecattr(w, "count") + m2.wv.get_vecattr(w, "count"), reverse=True)    # update for Gensim 4
-    
-    
+    n = len(common_vocab)
+    indices_m1 = np.fromiter((vocab_m1[w] for w in common_vocab), dtype=np.intp, count=n)
+    indices_m2 = np.fromiter((vocab_m2[w] for w in common_vocab), dtype=np.intp, count=n)
+    counts = m1.wv.expandos['count'][indices_m1] + m2.wv.expandos['count'][indices_m2]
+    order = np.argsort(-counts, kind='stable')
+    common_vocab = [common_vocab[i] for i in order]
+
     # Then for each model...
-    for m in [m1, m2]:
-        # Replace old vectors_norm array with new one (with common vocab)
-        indices = [m.wv.key_to_index[w] for w in common_vocab]                        
-        old_arr = m.wv.vectors                                            # update for Gensim 4
-        new_arr = np.array([old_arr[index] for index in indices])
-        m.wv.vectors = new_arr
-        m.wv.norms = np.linalg.norm(m.wv.vectors, axis=1)
-
-        # Replace old vocab dictionary with new one (with common vocab)
-        # and old index2word with new one
-        
-        m.wv.index_to_key = common_vocab               # update for Gensim 4
-        m.wv.key_to_index = {word: index for index, word in enumerate(common_vocab)}      # no need to create old/new vocab anymore
-        
-        # Remove words not in common_vocab from key_to_index and index_to_key
-        for word in list(m.wv.key_to_index.keys()):
-            if word not in common_vocab:
-                del m.wv.key_to_index[word]
-                if word in m.wv.index_to_key:  # Check if word exists before removing
-                    m.wv.index_to_key.remove(word)        
-        
+    for m, indices in [(m1, indices_m1[order]), (m2, indices_m2[order])]:
+        _restrict_vocab(m.wv, indices, common_vocab)
+
     return m1, m2
 
+
+def _restrict_vocab(wv, indices, common_vocab):
+    ''' Keep only rows `indices` of a model's KeyedVectors, relabelled  '''
+    ''' 0..N as the words of common_vocab.                              '''
+    # Take the common rows with one fancy-indexing copy (dtype is kept)
+    wv.vectors = wv.vectors[indices]                                     # update for Gensim 4
+    wv.norms = np.linalg.norm(wv.vectors, axis=1)
+    # Keep the per-word attributes (counts etc.) in step with the rows
+    for attr in list(wv.expandos):
+        wv.expandos[attr] = wv.expandos[attr][indices]
+
+    # Replace old vocab dictionary and index_to_key with the common vocab
+    wv.index_to_key = list(common_vocab)                                 # update for Gensim 4
+    wv.key_to_index = {word: index for index, word in enumerate(common_vocab)}
+
+@instrumented('align')
 def smart_procrustes_align_gensim(base_embed, other_embed, words=None):
     """Procrustes align two gensim word2vec models (to allow for comparison between same word across models).
 	Code credit due to Ryan Heuser (https://gist.github.com/quadrismegistus/).
@@ -97,118 +133,896 @@ def smart_procrustes_align_gensim(base_embed, other_embed, words=None):
     return other_embed
 
 
-def align_and_produce_new_model(earth_model, moon_sentences):
+class AlignmentBase(object):
+    ''' Read-only Procrustes reference built once from a base model.   '''
+    ''' Holds the base's word index, counts and normalized vectors, so  '''
+    ''' any number of models can be aligned to it without copying or   '''
+    ''' intersecting the base itself.                                  '''
+
+    def __init__(self, base_embed):
+        self.index_to_key = list(base_embed.wv.index_to_key)
+        self.key_to_index = dict(base_embed.wv.key_to_index)
+        self.counts = np.array(base_embed.wv.expandos['count'])
+        self.normed = base_embed.wv.get_normed_vectors()
+
+    @instrumented('align')
+    def align(self, other_embed, words=None):
+        ''' Same result as smart_procrustes_align_gensim(base, other):   '''
+        ''' other_embed (a model or its KeyedVectors) is cut to the      '''
+        ''' shared vocabulary (ordered by summed counts), rotated onto   '''
+        ''' the base, and returned.                                      '''
+        other_wv = other_embed.wv if hasattr(other_embed, 'wv') else other_embed
+        base_index = self.key_to_index
+        other_index = other_wv.key_to_index
+        common_vocab = [w for w in self.index_to_key if w in other_index]
+        if words:
+            words = set(words)
+            common_vocab = [w for w in common_vocab if w in words]
+        n = len(common_vocab)
+        indices_base = np.fromiter((base_index[w] for w in common_vocab), dtype=np.intp, count=n)
+        indices_other = np.fromiter((other_index[w] for w in common_vocab), dtype=np.intp, count=n)
+        counts = self.counts[indices_base] + other_wv.expandos['count'][indices_other]
+        order = np.argsort(-counts, kind='stable')
+        common_vocab = [common_vocab[i] for i in order]
+        _restrict_vocab(other_wv, indices_other[order], common_vocab)
+
+        base_vecs = self.normed[indices_base[order]]
+        other_vecs = other_wv.get_normed_vectors()
+        u, _, v = np.linalg.svd(other_vecs.T.dot(base_vecs))
+        ortho = u.dot(v)
+        other_wv.vectors = (other_wv.vectors).dot(ortho)
+        other_wv.norms = np.linalg.norm(other_wv.vectors, axis=1)
+        return other_embed
+
+
+def replicate_seed(seed, era, replicate):
+    ''' Resampling seed of one (era, replicate) job, derived from the  '''
+    ''' root seed so every pipeline draws the same sample for it.     '''
+    return int(np.random.SeedSequence([seed, era, replicate]).generate_state(1)[0])
+
+
+class ModelStore(object):
+    ''' Directory of trained models keyed by a hash of (corpus text,    '''
+    ''' seed, hyperparameters, gensim version). Bootstrap replicates   '''
+    ''' are kept as KeyedVectors (get/put), which is all alignment and '''
+    ''' stats need, so the naive loop and the aligned pipeline train   '''
+    ''' each one only once; deterministic full models such as the era  '''
+    ''' and full-corpus models are kept whole (get_model/put_model).   '''
+    ''' Entries are saved in gensim's format with large arrays in      '''
+    ''' separate .npy files and loaded with mmap='r'. With max_bytes,   '''
+    ''' the least recently used entries are evicted after each put     '''
+    ''' until the store fits.                                          '''
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, sentences, seed, params, kind='vectors'):
+        spec = {'corpus': sentences_fingerprint(sentences), 'seed': int(seed), 
+                'params': params, 'kind': kind, 'gensim': gensim.__version__}
+        return hashlib.sha1(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _load(self, key, filename, loader):
+        path = os.path.join(self.directory, key)
+        if not os.path.isdir(path):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        with measure('model_load', kind=filename):
+            return loader(os.path.join(path, filename), mmap='r')
+
+    def _save(self, obj, key, filename):
+        ''' Save into a temporary directory and rename it into place, so '''
+        ''' concurrent writers and interrupted runs never leave a       '''
+        ''' half-written entry.                                          '''
+        path = os.path.join(self.directory, key)
+        if os.path.isdir(path):
+            return
+        staging = tempfile.mkdtemp(dir=self.directory, prefix='.tmp_')
+        with measure('model_save', kind=filename):
+            obj.save(os.path.join(staging, filename), sep_limit=0)
+        try:
+            os.rename(staging, path)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict(keep=key)
+
+    def get(self, sentences, seed, params):
+        return self._load(self.key(sentences, seed, params), 'vectors.kv', KeyedVectors.load)
+
+    def put(self, wv, sentences, seed, params):
+        self._save(wv, self.key(sentences, seed, params), 'vectors.kv')
+
+    def model_key(self, sentences, params):
+        ''' Key of the Word2Vec model trained on sentences with params  '''
+        ''' (its seed is params['seed'], gensim's default 1 if unset).  '''
+        return self.key(sentences, params.get('seed', 1), params, kind='model')
+
+    def get_model(self, sentences, params, key=None):
+        ''' The Word2Vec model trained on sentences with params, or None. '''
+        if key is None:
+            key = self.model_key(sentences, params)
+        return self._load(key, 'model.w2v', Word2Vec.load)
+
+    def put_model(self, model, sentences, params, key=None):
+        ''' Store model under the key get_model() looks it up by; returns '''
+        ''' that key.                                                     '''
+        if key is None:
+            key = self.model_key(sentences, params)
+        self._save(model, key, 'model.w2v')
+        return key
+
+    def evict(self, keep=None):
+        ''' Delete least recently used entries (by directory mtime,     '''
+        ''' which get refreshes) until the store is within max_bytes.   '''
+        if self.max_bytes is None:
+            return
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+                entries.append((os.stat(path).st_mtime, size, name))
+            except OSError:
+                continue
+            total += size
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            # Processes that already mapped the entry keep reading it.
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+            total -= size
+
+
+# Roughly 1,400 sets of bootstrap vectors are kept between runs
+BOOTSTRAP_STORE_BYTES = 20 * 2**30
+
+
+def default_store():
+    ''' The ./bootstrap_models store that the naive, aligned and sweep '''
+    ''' runs share, capped at BOOTSTRAP_STORE_BYTES so that every one  '''
+    ''' of them evicts to the same limit.                              '''
+    return ModelStore('bootstrap_models', max_bytes=BOOTSTRAP_STORE_BYTES)
+
+
+def cached_word2vec(sentences, store=None, workers=4, params=BOOTSTRAP_PARAMS):
+    ''' Word2Vec(sentences, workers=workers, **params), loaded from the '''
+    ''' store when an identical model has been trained before and put  '''
+    ''' there otherwise. Loaded models are memory-mapped read-only.    '''
+    key = None
+    if store is not None:
+        # One key for the lookup and the put, taken from the caller's params
+        key = store.model_key(sentences, params)
+        model = store.get_model(sentences, params, key)
+        if model is not None:
+            return model
+    # Word2Vec(sentences, ...) in two steps, so the training is measured
+    train_params = dict(params)
+    max_epochs = train_params.pop('epochs')
+    model = Word2Vec(workers = workers, epochs = max_epochs, **train_params)
+    build_vocab(model, sentences)
+    train_epochs(model, sentences, max_epochs, total_examples = model.corpus_count)
+    if store is not None:
+        store.put_model(model, sentences, params, key)
+    return model
+
+
+def build_vocab(model, sentences):
+    ''' model.build_vocab(sentences), but from precomputed word counts  '''
+    ''' (an encoded corpus's TermIndex) when the sentences provide them, '''
+    ''' which skips the scan over the sample.                          '''
+    if hasattr(sentences, 'word_freq'):
+        word_freq = sentences.word_freq()
+        model.build_vocab_from_freq(word_freq, corpus_count = len(sentences))
+        model.corpus_total_words = sum(word_freq.values())
+    else:
+        model.build_vocab(sentences)
+
+
+def bootstrap_vectors(sentences, seed, workers=4, store=None, params=BOOTSTRAP_PARAMS, 
+                      convergence=None, probes=None, redraw=0):
+    ''' Word vectors of a model trained on a bootstrap resample of     '''
+    ''' sentences drawn with `seed`, taken from the store if an equal  '''
+    ''' replicate was already trained. With `convergence` (keyword     '''
+    ''' arguments for ConvergenceMonitor) training stops early once it '''
+    ''' plateaus. The epochs run are kept as wv.epochs_used.           '''
+    ''' With a ProbeSet, the sample is checked against the corpus's    '''
+    ''' inverted index first: if no pair can be scored on it, nothing  '''
+    ''' is trained and None is returned. redraw > 0 instead draws a    '''
+    ''' new sample (from the same seeded stream, up to redraw times)   '''
+    ''' while any pair is missing a word.                              '''
+    key_params = params if convergence is None else dict(params, convergence=convergence)
+    if convergence is not None and probes is not None:
+        # the monitor stops on these probes' similarities, so they shape the vectors
+        key_params = dict(key_params, probes=probes.pairs)
+    if redraw and probes is not None:
+        key_params = dict(key_params, redraw=redraw, probes=probes.pairs)
+    if store is not None:
+        wv = store.get(sentences, seed, key_params)
+        if wv is not None:
+            return wv
+    rng = np.random.default_rng(seed)
+    sample = resample_sentences(sentences, rng)
+    if probes is not None:
+        computable = probes.computable(sample)
+        for attempt in range(0, redraw):
+            if computable is None or computable.all():
+                break
+            sample = resample_sentences(sentences, rng)
+            computable = probes.computable(sample)
+        if computable is not None and not computable.any():
+            return None
+    params = dict(params)
+    max_epochs = params.pop('epochs')
+    model = Word2Vec(workers = workers, epochs = max_epochs, **params)
+    build_vocab(model, sample)
+    monitor = None
+    if convergence is not None:
+        monitor = ConvergenceMonitor(EQUALITY_PROBES if probes is None else probes, **convergence)
+    model.wv.epochs_used = train_epochs(model, sample, max_epochs, monitor, model.corpus_count)
+    if store is not None:
+        store.put(model.wv, sentences, seed, key_params)
+    return model.wv
+
+
+def align_and_produce_new_model(earth_model, moon_sentences, rng=None, seed=None, store=None, 
+                                convergence=None, probes=None, redraw=0, params=BOOTSTRAP_PARAMS, 
+                                workers=4):
     ''' Take a base model and align a second model to it, resampling the '''
     ''' sentences from the second model's corpus before modeling.        '''
-    sentences = resample(moon_sentences)
-    moon_model = Word2Vec(sentences, vector_size = 100, min_count = 0, epochs = 200, 
-                     sg = 1, hs = 0, negative = 5, window = 10, workers = 4)
-    moon_model.wv.init_sims()
-    tidal_lock = smart_procrustes_align_gensim(earth_model, moon_model)
+    ''' earth_model may be a model or a prebuilt AlignmentBase; either   '''
+    ''' way it is left unchanged. The resample is drawn with `seed` (or  '''
+    ''' a seed taken from rng), and the replicate is reused from store   '''
+    ''' when present. Returns the aligned KeyedVectors, or None when    '''
+    ''' probes are given and none of them can be scored on the resample '''
+    ''' (see bootstrap_vectors).                                         '''
+    if seed is None:
+        if rng is None:
+            rng = np.random.default_rng()
+        seed = int(rng.integers(2**32))
+    if not isinstance(earth_model, AlignmentBase):
+        earth_model = AlignmentBase(earth_model)
+    moon_model = bootstrap_vectors(moon_sentences, seed, workers=workers, store=store, 
+                                   params=params, convergence=convergence, probes=probes, 
+                                   redraw=redraw)
+    if moon_model is None:
+        return None
+    tidal_lock = earth_model.align(moon_model)
     moon_model = None
     return tidal_lock
     
     
-def produce_model_stats(model):
-    gender = []
-    intl = []
-    german = []
-    race = []
-    afam = []
-    while True:
-        try:
-            gender.append(model.wv.similarity('equality','gender'))
-            break
-        except KeyError:
-            gender.append('NA')
-            break
-    while True:
-        try:
-            intl.append(model.wv.similarity('equality','treaty'))
-            break
-        except KeyError:
-            intl.append('NA')
-            break
-    while True:
-        try:
-            german.append(model.wv.similarity('equality','german'))
-            break
-        except KeyError:
-            german.append('NA')
-            break
-    while True:
-        try:
-            race.append(model.wv.similarity('equality','race'))
-            break
-        except KeyError:
-            race.append('NA')
-            break
-    while True:
-        try:
-            afam.append(model.wv.similarity('equality','african_american'))
-            break
-        except KeyError:
-            afam.append('NA')
-            break
-    stats = gender, intl, german, race, afam
-    return list(stats)
+class ProbeSet(object):
+    ''' A list of (target, probe) word pairs whose cosine similarities  '''
+    ''' are read off each model. The distinct words and the pair       '''
+    ''' positions are resolved once here, so a model costs one vocab   '''
+    ''' lookup per distinct word and a single normalized-matrix        '''
+    ''' product, however many pairs there are.                         '''
+
+    def __init__(self, pairs):
+        self.pairs = [tuple(pair) for pair in pairs]
+        self.words = []
+        position = {}
+        for pair in self.pairs:
+            for word in pair:
+                if word not in position:
+                    position[word] = len(self.words)
+                    self.words.append(word)
+        self.targets = np.array([position[t] for t, p in self.pairs], dtype=np.intp)
+        self.probes = np.array([position[p] for t, p in self.pairs], dtype=np.intp)
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def names(self):
+        return [t + '-' + p for t, p in self.pairs]
+
+    def computable(self, sentences):
+        ''' Bool array: whether both words of each pair occur in        '''
+        ''' sentences, so a model trained on them can score the pair.   '''
+        ''' None when the sentences cannot answer without a scan (only  '''
+        ''' encoded-corpus views provide contains()).                   '''
+        if not hasattr(sentences, 'contains'):
+            return None
+        present = sentences.contains(self.words)
+        return present[self.targets] & present[self.probes]
+
+    @instrumented('stats')
+    def similarities(self, model):
+        ''' float32 array of cosine similarities, one per pair, with    '''
+        ''' NaN where either word is missing from the model.           '''
+        return self._similarities(model)
+
+    def _similarities(self, model):
+        # Not measured: ConvergenceMonitor calls this after every epoch
+        wv = model.wv if hasattr(model, 'wv') else model
+        index = np.array([wv.key_to_index.get(w, -1) for w in self.words], dtype=np.intp)
+        present = index >= 0
+        unit = np.zeros((len(self.words), wv.vector_size), dtype=np.float32)
+        vecs = wv.vectors[index[present]]
+        unit[present] = vecs / np.linalg.norm(vecs, axis=1)[:, None]
+        gram = unit.dot(unit.T)
+        sims = gram[self.targets, self.probes]
+        sims[~(present[self.targets] & present[self.probes])] = np.nan
+        return sims
+
+
+EQUALITY_PROBES = ProbeSet([('equality', 'gender'), ('equality', 'treaty'), 
+                            ('equality', 'german'), ('equality', 'race'), 
+                            ('equality', 'african_american')])
+
+CHRONO_PROBES = ProbeSet(EQUALITY_PROBES.pairs + [('equality', 'social')])
+
+
+def with_na(sims):
+    ''' Similarities as a list with 'NA' for missing words, the form  '''
+    ''' the scripts pickle.                                           '''
+    return [sim if not np.isnan(sim) else 'NA' for sim in sims]
+
+
+def produce_model_stats(model, probes=EQUALITY_PROBES):
+    ''' One single-element list per probe pair ('NA' if a word is    '''
+    ''' missing), in the order of probes.                             '''
+    return [[sim] for sim in with_na(probes.similarities(model))]
     
     
-def iterate_model_stats(list_of_lists, iterations):
+## Convergence-based early stopping
+
+class ConvergenceMonitor(CallbackAny2Vec):
+    ''' Epoch callback that tracks the training loss and the probe     '''
+    ''' similarities. Sets `converged` once, for `patience` epochs in a '''
+    ''' row, the loss moved by at most loss_tol (relative) and no probe '''
+    ''' similarity by more than sim_tol, after at least min_epochs.    '''
+
+    def __init__(self, probes=EQUALITY_PROBES, loss_tol=0.01, sim_tol=0.005, patience=3, 
+                 min_epochs=10):
+        self.probes = probes
+        self.loss_tol = loss_tol
+        self.sim_tol = sim_tol
+        self.patience = patience
+        self.min_epochs = min_epochs
+        self.epochs = 0
+        self.stable = 0
+        self.converged = False
+        self.losses = []
+        self.last_sims = None
+
+    def on_epoch_end(self, model):
+        loss = model.get_latest_training_loss()
+        sims = self.probes._similarities(model)
+        if self.losses:
+            previous = self.losses[-1]
+            loss_change = abs(loss - previous) / max(abs(previous), 1e-12)
+            both = ~np.isnan(sims) & ~np.isnan(self.last_sims)
+            sim_change = np.abs(sims[both] - self.last_sims[both]).max() if both.any() else 0.0
+            if loss_change <= self.loss_tol and sim_change <= self.sim_tol:
+                self.stable += 1
+            else:
+                self.stable = 0
+        self.epochs += 1
+        self.losses.append(loss)
+        self.last_sims = sims
+        self.converged = self.epochs >= self.min_epochs and self.stable >= self.patience
+
+
+## The ConvergenceMonitor settings the scripts' and the pipeline's --converge
+## turn on; they are part of the stored models' keys and the results logs'
+## settings.
+CONVERGENCE_PARAMS = dict(loss_tol=0.01, sim_tol=0.005, patience=3, min_epochs=10)
+
+
+def train_epochs(model, sentences, max_epochs, monitor=None, total_examples=None):
+    ''' Train a model whose vocabulary is built for up to max_epochs.   '''
+    ''' With a monitor, epochs run one train() call at a time on the    '''
+    ''' same linear learning-rate schedule a single call would use, and '''
+    ''' training stops as soon as the monitor reports convergence.     '''
+    ''' Returns the number of epochs run. Measured as a 'train' event   '''
+    ''' with the effective words gensim reports.                        '''
+    if total_examples is None:
+        total_examples = len(sentences)
+    with measure('train') as event:
+        if monitor is None:
+            words, _ = model.train(sentences, total_examples = total_examples, epochs = max_epochs)
+            event['words'], event['epochs'] = words, max_epochs
+            return max_epochs
+        start_alpha, end_alpha = model.alpha, model.min_alpha
+        step = (start_alpha - end_alpha) / max_epochs
+        words = 0
+        for epoch in range(max_epochs):
+            trained, _ = model.train(sentences, total_examples = total_examples, epochs = 1, 
+                                     start_alpha = start_alpha - step * epoch, 
+                                     end_alpha = start_alpha - step * (epoch + 1), 
+                                     compute_loss = True, callbacks = [monitor])
+            words += trained
+            if monitor.converged:
+                break
+        # train() overwrote the schedule; keep the configured one
+        model.epochs, model.alpha, model.min_alpha = max_epochs, start_alpha, end_alpha
+        event['words'], event['epochs'] = words, epoch + 1
+        return epoch + 1
+
+
+def iterate_model_stats(list_of_lists, iterations, seed=6801, probes=EQUALITY_PROBES, store=None, 
+                        log=None, method='aligned', convergence=None, stopping=None, redraw=0, 
+                        params=BOOTSTRAP_PARAMS):
+    ''' Aligned-model bootstrap over eras 2..n. Replicate i of an era   '''
+    ''' uses replicate_seed(seed, era, i), the same sample the naive   '''
+    ''' engine draws, so with a shared ModelStore its models are       '''
+    ''' reused instead of retrained; the full era models are kept there  '''
+    ''' too (each era's is shared by two alignments and by reruns).     '''
+    ''' With a ResultsLog, each replicate is logged as it finishes and  '''
+    ''' ones already logged are skipped.                                '''
+    ''' `convergence` turns on early stopping for the replicates (see   '''
+    ''' bootstrap_vectors); the epochs each used go into the log.       '''
+    ''' With a StoppingRule, an era stops early once its probes' CIs    '''
+    ''' are narrow enough, so eras may return fewer than `iterations`.  '''
+    ''' Resamples lacking every probe word are recorded as NA without  '''
+    ''' training; `redraw` redraws them instead (see bootstrap_vectors). '''
     full_stats = []
+    progress = Progress(method, iterations * (len(list_of_lists) - 1))
     earth_model = None
-    earth_model = Word2Vec(list_of_lists[0], vector_size = 100, min_count = 0, epochs = 200, 
-                       sg = 1, hs = 0, negative = 5, window = 10, workers = 4, compute_loss=True)
+    with context(method=method, era=0):
+        earth_model = cached_word2vec(list_of_lists[0], store, params=params)
     # earth_model.wv.init_sims()                 # init_sims() was deprecated in Gensim 4
     for k in range(0, len(list_of_lists)-1):
         era_stats = []
+        # The base is only read during alignment, so one reference per era
+        # replaces a deep copy of the whole model per iteration.
+        earth = AlignmentBase(earth_model)
+        online = OnlineStats(len(probes))
         for i in range(0, iterations):
-            earth = copy.deepcopy(earth_model)
-            moon_model = align_and_produce_new_model(earth, list_of_lists[k+1])
-            iter_stats = produce_model_stats(moon_model)
-            era_stats.append(iter_stats)
             run = i+1
             era = k+1
+            if stopping is not None and stopping.satisfied(online):
+                print("Stopping era %d after %d runs: CIs are narrow enough." % (era, i))
+                progress.skip(iterations - i)
+                break
+            logged = log.get(method, era, i) if log is not None else None
+            if logged is not None:
+                era_stats.append([[sim] for sim in logged])
+                online.update(logged)
+                progress.skip(1)
+                continue
+            moon_seed = replicate_seed(seed, k+1, i)
+            with context(method=method, era=era, replicate=i):
+                moon_model = align_and_produce_new_model(earth, list_of_lists[k+1], 
+                                                         seed=moon_seed, store=store, 
+                                                         convergence=convergence, probes=probes, 
+                                                         redraw=redraw, params=params)
+                if moon_model is None:
+                    iter_stats = [['NA'] for p in range(0, len(probes))]
+                else:
+                    iter_stats = produce_model_stats(moon_model, probes)
+            era_stats.append(iter_stats)
+            online.update([stat[0] for stat in iter_stats])
+            if log is not None:
+                log.append(method, era, i, [stat[0] for stat in iter_stats], 
+                           epochs=getattr(moon_model, 'epochs_used', None), seed=moon_seed)
             print("Finished with run %d out of %d for era %d." % (run, iterations, era))
-            earth = None
+            progress.advance()
+        earth = None
         new_earth = None
-        new_earth = Word2Vec(list_of_lists[k], vector_size = 100, min_count = 0, epochs = 200, 
-                     sg = 1, hs = 0, negative = 5, window = 10, workers = 4)
-        new_moon = Word2Vec(list_of_lists[k+1], vector_size = 100, min_count = 0, epochs = 200, 
-                     sg = 1, hs = 0, negative = 5, window = 10, workers = 4)
-        earth_model = smart_procrustes_align_gensim(new_earth, new_moon)
+        with context(method=method, era=era):
+            new_earth = cached_word2vec(list_of_lists[k], store, params=params)
+            new_moon = cached_word2vec(list_of_lists[k+1], store, params=params)
+            earth_model = smart_procrustes_align_gensim(new_earth, new_moon)
         full_stats.append(era_stats)
         print("*******Finished with era %d.*******" % (era))
     return full_stats
     
     
-def chrono_train(n_iterations, current_corpus, previous_model, output_model):
+class ModelSnapshot(object):
+    ''' A model loaded once and handed out as fresh trainable copies.   '''
+    ''' Only the state that training changes (the input and output     '''
+    ''' weights, the random state and the norms) is copied; vocabulary  '''
+    ''' and the negative-sampling table are shared read-only, so a copy '''
+    ''' costs a memcpy instead of a Word2Vec.load from disk.            '''
+
+    def __init__(self, model, mmap=None):
+        if isinstance(model, str):
+            with measure('model_load', kind='model'):
+                model = Word2Vec.load(model, mmap=mmap)
+        self.model = model
+
+    def fresh(self):
+        model = copy.copy(self.model)
+        model.wv = copy.copy(self.model.wv)
+        model.wv.vectors = self.model.wv.vectors.copy()
+        model.wv.norms = None
+        if hasattr(self.model, 'syn1neg'):
+            model.syn1neg = self.model.syn1neg.copy()
+        if hasattr(self.model, 'syn1'):
+            model.syn1 = self.model.syn1.copy()
+        model.random = copy.deepcopy(self.model.random)
+        if hasattr(self.model, 'lifecycle_events'):
+            model.lifecycle_events = list(self.model.lifecycle_events)
+        return model
+
+
+def _chrono_iteration(snapshot, current_corpus, seed, probes, output_model=None, threads=None, 
+                      convergence=None):
+    ''' Train one fresh copy of the snapshot on a resample drawn with  '''
+    ''' seed; save it to output_model if given. Returns the stats and '''
+    ''' the number of epochs trained.                                  '''
+    sentence_samples = resample_sentences(current_corpus, np.random.default_rng(seed))
+    model = snapshot.fresh()
+    if threads is not None:
+        model.workers = threads
+    monitor = None if convergence is None else ConvergenceMonitor(probes, **convergence)
+    epochs = train_epochs(model, sentence_samples, model.epochs, monitor)
+    sims = with_na(probes.similarities(model))
+    if output_model is not None:
+        with measure('model_save', kind='model'):
+            model.save(output_model)
+    return sims, epochs
+
+
+_chrono_snapshot = None
+_chrono_corpus = None
+
+
+def _init_chrono_worker(previous_model, current_corpus):
+    # mmap='r' lets every worker share the starting weights read-only;
+    # each iteration then trains on its own private copy.
+    global _chrono_snapshot, _chrono_corpus
+    _chrono_snapshot = ModelSnapshot(previous_model, mmap='r')
+    _chrono_corpus = current_corpus
+
+
+def _chrono_replicate(job):
+    k, seed, threads, probes, output_model, convergence = job
+    with context(replicate=k):
+        return (k,) + _chrono_iteration(_chrono_snapshot, _chrono_corpus, seed, probes, 
+                                        output_model, threads, convergence)
+
+
+def chrono_train(n_iterations, current_corpus, previous_model, output_model, seed=6801, 
+                 probes=CHRONO_PROBES, log=None, era=None, method='chrono', 
+                 processes=1, threads=None, convergence=None, stopping=None, progress=None):
     ''' Models the current corpus by initializing with the vectors of  '''
     ''' the previous model, outputs similarity scores of new model,    '''
     ''' and saves that new model for the next round of modeling        '''
-    gender = []
-    intl = []
-    german = []
-    race = []
-    afam = []
-    social = []
+    ''' Iteration k resamples with its own seed spawned from `seed` (an '''
+    ''' int or list of ints; None would draw fresh OS entropy).         '''
+    ''' processes > 1 (or None to pick from the core count) runs the    '''
+    ''' iterations over a process pool; the first iteration's model is '''
+    ''' the one saved to output_model.                                 '''
+    ''' With a ResultsLog, iterations are logged under `era` (default  '''
+    ''' output_model) and already-logged ones are skipped; the first    '''
+    ''' iteration only counts as done once output_model is saved.      '''
+    ''' `convergence` (ConvergenceMonitor keyword arguments) lets each  '''
+    ''' iteration stop before model.epochs once it plateaus; the epochs '''
+    ''' used are logged. With a StoppingRule, no further iterations are '''
+    ''' started once the probes' CIs are narrow enough, and only the    '''
+    ''' iterations that ran are returned. A Progress (instrument_       '''
+    ''' functions) is advanced once per iteration run.                  '''
+    if era is None:
+        era = output_model
+    if progress is None:
+        progress = Progress(method, n_iterations)
+    seeds = [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(n_iterations)]
+    results = [None] * n_iterations
+    online = OnlineStats(len(probes))
+    todo = []
     for k in range(n_iterations):
-        sentence_samples = resample(current_corpus)
-        model = Word2Vec.load(previous_model)
-        model.train(sentence_samples, total_examples = len(sentence_samples), epochs = model.epochs)
-        gender.append(model.wv.similarity('equality','gender'))
-        intl.append(model.wv.similarity('equality','treaty'))
-        german.append(model.wv.similarity('equality','german'))
-        race.append(model.wv.similarity('equality','race'))
-        afam.append(model.wv.similarity('equality','african_american'))
-        social.append(model.wv.similarity('equality','social'))
-        run = k+1
-        print("Finished with run %d out of %d" % (run, n_iterations))
-    model.save(output_model)
-    stats = gender, intl, german, race, afam, social
-    return list(stats) 
-    
-    
-    
-    
-    
\ No newline at end of file
+        logged = log.get(method, era, k) if log is not None else None
+        if logged is not None and (k != 0 or os.path.exists(output_model)):
+            results[k] = logged
+            online.update(logged)
+        else:
+            todo.append(k)
+    done = n_iterations - len(todo)
+    progress.skip(done)
+
+    def stop(group=None):
+        # Iteration 0 saves output_model for the next era, so it always runs.
+        return stopping is not None and results[0] is not None and stopping.satisfied(online)
+
+    if todo and processes == 1:
+        # previous_model is read from disk once; every iteration then
+        # starts from an in-memory copy of the same weights.
+        with context(method=method, era=era):
+            snapshot = ModelSnapshot(previous_model)
+        for k in todo:
+            if stop():
+                break
+            with context(method=method, era=era, replicate=k):
+                results[k], epochs = _chrono_iteration(snapshot, current_corpus, seeds[k], probes, 
+                                                       output_model if k == 0 else None, 
+                                                       convergence=convergence)
+            online.update(results[k])
+            if log is not None:
+                log.append(method, era, k, results[k], epochs=epochs, seed=seeds[k])
+            done += 1
+            print("Finished with run %d out of %d" % (done, n_iterations))
+            progress.advance()
+    elif todo:
+        processes, threads = pool_layout(len(todo), processes, threads)
+        jobs = [(k, seeds[k], threads, probes, output_model if k == 0 else None, convergence) 
+                for k in todo]
+        # Workers forked inside the context tag their events with it.
+        with context(method=method, era=era), \
+                _process_pool(processes, _init_chrono_worker, 
+                              (previous_model, current_corpus)) as pool:
+            for k, sims, epochs in _schedule(pool, _chrono_replicate, [jobs], 2 * processes, stop):
+                results[k] = sims
+                online.update(sims)
+                if log is not None:
+                    log.append(method, era, k, sims, epochs=epochs, seed=seeds[k])
+                done += 1
+                print("Finished with run %d out of %d" % (done, n_iterations))
+                progress.advance()
+    if done < n_iterations and stop():
+        print("Stopped after %d of %d runs: CIs are narrow enough." % (done, n_iterations))
+        progress.skip(n_iterations - done)
+
+    ran = [k for k in range(n_iterations) if results[k] is not None]
+    stats = [[results[k][p] for k in ran] for p in range(len(probes))]
+    return stats
+
+
+def chrono_era_stats(corpus, n_iterations, seed=6801, probes=CHRONO_PROBES, store=None, log=None, 
+                     method='chrono', processes=None, convergence=None, stopping=None, 
+                     params=BOOTSTRAP_PARAMS):
+    ''' The whole chronological pipeline of 04-chrono_word2vec.py on an '''
+    ''' EncodedCorpus: a model of the full corpus (through the store,   '''
+    ''' if given) is saved as model1_of_fullcorpus.model, then each era '''
+    ''' in turn is chrono_train'ed from the previous era's model,       '''
+    ''' saving model<j+2>_of_<era>.model. Era j's iterations are seeded '''
+    ''' from (seed, j). Returns the [stat][era][iteration] lists.        '''
+    sentences = [corpus.sentences(j) for j in range(0, len(corpus))]
+    previous_model = "model1_of_fullcorpus.model"
+    with context(method=method):
+        full_model = cached_word2vec(ChainedSentences(sentences), store, params=params)
+        with measure('model_save', kind='model'):
+            full_model.save(previous_model)
+    full_model = None
+    progress = Progress(method, n_iterations * len(corpus))
+    stat_types = [[] for p in range(0, len(probes))]
+    for j in range(0, len(corpus)):
+        output_model = "model%d_of_%s.model" % (j+2, corpus.eras[j])
+        results = chrono_train(n_iterations, sentences[j], previous_model, output_model, 
+                               seed=None if seed is None else [seed, j], probes=probes, log=log, 
+                               era=j, method=method, processes=processes, 
+                               convergence=convergence, stopping=stopping, progress=progress)
+        for p in range(0, len(probes)):
+            stat_types[p].append(results[p])
+        previous_model = output_model
+        print("*******Finished with era %d.*******" % (j+1))
+    return stat_types
+
+
+## Parallel bootstrap engine for the naive and overlap era loops
+
+_bootstrap_corpus = None
+
+
+def pool_layout(n_jobs, processes=None, threads=None):
+    ''' Decide how many worker processes to run and how many gensim     '''
+    ''' threads each one gets. Gensim's own threads stop scaling beyond '''
+    ''' a handful of workers, so cores go to processes first and any    '''
+    ''' left over are handed out as threads.                            '''
+    cores = os.cpu_count() or 1
+    if processes is None:
+        if threads is None:
+            processes = min(n_jobs, cores)
+        else:
+            processes = min(n_jobs, max(1, cores // threads))
+    processes = max(1, processes)
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        processes = 1                       # jobs run serially, see _SerialPool
+    if threads is None:
+        threads = min(4, max(1, cores // processes))
+    return processes, threads
+
+
+class _SerialPool(object):
+    ''' Stand-in for _process_pool where fork is unavailable: under     '''
+    ''' spawn every worker re-imports the calling script, and the       '''
+    ''' scripts here run at top level, so jobs run in this process.     '''
+    def __init__(self, initializer, initargs):
+        initializer(*initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def _process_pool(processes, initializer, initargs):
+    ''' A ProcessPoolExecutor of `processes` workers, each set up with  '''
+    ''' initializer(*initargs). Forked, so children inherit module      '''
+    ''' state; without fork the jobs run serially (see _SerialPool).   '''
+    ''' A worker that dies (e.g. killed for memory) breaks the pool, so '''
+    ''' its jobs raise BrokenProcessPool rather than hang.              '''
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return _SerialPool(initializer, initargs)
+    return ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('fork'), 
+                               initializer=initializer, initargs=initargs)
+
+
+def _schedule(pool, func, groups, window, stop=None):
+    ''' Run the jobs of each group on pool (see _process_pool), taking '''
+    ''' one job from each group in turn and keeping at most `window` in '''
+    ''' flight, and yield results as they finish. Before a job of group '''
+    ''' g is submitted, stop(g) is asked; once it says yes the rest of  '''
+    ''' g is dropped. Nothing is queued ahead, so a stop takes effect   '''
+    ''' after at most `window` extra jobs.                               '''
+    finished = queue.Queue()
+    pending = [list(group) for group in groups]
+    position = [0] * len(pending)
+    turn = 0
+    in_flight = 0
+    while True:
+        while in_flight < window:
+            job = None
+            for _ in range(len(pending)):
+                g = turn
+                turn = (turn + 1) % len(pending)
+                if position[g] < len(pending[g]) and stop is not None and stop(g):
+                    position[g] = len(pending[g])
+                if position[g] < len(pending[g]):
+                    job = pending[g][position[g]]
+                    position[g] += 1
+                    break
+            if job is None:
+                break
+            pool.submit(func, job).add_done_callback(finished.put)
+            in_flight += 1
+        if in_flight == 0:
+            return
+        future = finished.get()
+        in_flight -= 1
+        # raises the job's exception, or BrokenProcessPool if its worker died
+        yield future.result()
+
+
+def _init_bootstrap_worker(shared):
+    global _bootstrap_corpus
+    _bootstrap_corpus = attach(shared)
+
+
+def _bootstrap_replicate(job):
+    ''' Train one resampled era model and return its similarity stats. '''
+    era, replicate, seed, threads, probes, store, convergence, redraw, params = job
+    with context(era=era, replicate=replicate):
+        wv = bootstrap_vectors(_bootstrap_corpus.sentences(era), seed, workers=threads, 
+                               store=store, params=params, convergence=convergence, 
+                               probes=probes, redraw=redraw)
+        if wv is None:
+            return era, replicate, ['NA'] * len(probes), None
+        return era, replicate, with_na(probes.similarities(wv)), getattr(wv, 'epochs_used', None)
+
+
+def bootstrap_era_stats(list_of_lists, n_bootstraps, processes=None, threads=None, seed=6801, 
+                        probes=EQUALITY_PROBES, store=None, log=None, method='naive', 
+                        convergence=None, stopping=None, redraw=0, seed_eras=None, 
+                        params=BOOTSTRAP_PARAMS):
+    ''' Bootstrap every era of list_of_lists n_bootstraps times, fanning '''
+    ''' the (era, replicate) jobs out over a process pool. Each job gets '''
+    ''' its own resampling seed derived from `seed`, so the draws do not '''
+    ''' depend on which process runs them. list_of_lists may also be an  '''
+    ''' EncodedCorpus or a WindowedCorpus; seed_eras[j], if given, is    '''
+    ''' the era number era j's seeds are derived from (default j).       '''
+    ''' params are the model hyperparameters, or a list with those of    '''
+    ''' each era. With a ModelStore, replicate vectors are saved for     '''
+    ''' (and reused from) the aligned pipeline. With a ResultsLog,       '''
+    ''' each finished replicate is logged under `method` and replicates '''
+    ''' already in the log are not rerun. `convergence` turns on early  '''
+    ''' stopping (see bootstrap_vectors), with the epochs used logged.  '''
+    ''' With a StoppingRule (results_functions), an era stops getting   '''
+    ''' new replicates once its probes' CIs are narrow enough; eras are  '''
+    ''' then returned with only the replicates that ran.                 '''
+    ''' Resamples that contain no probe's words are recorded as NA      '''
+    ''' without training; with redraw > 0 they are redrawn instead.     '''
+    ''' Returns the nested [stat][era][replicate] list the scripts      '''
+    ''' pickle.                                                          '''
+    if isinstance(list_of_lists, (EncodedCorpus, WindowedCorpus)):
+        corpus = list_of_lists
+    else:
+        corpus = encode_corpus(list_of_lists)
+    n_eras = len(corpus)
+    if seed_eras is None:
+        seed_eras = range(0, n_eras)
+    if isinstance(params, dict):
+        params = [params] * n_eras
+    stat_types = [[[None] * n_bootstraps for j in range(n_eras)] for s in range(len(probes))]
+    done = [0] * n_eras
+    online = [OnlineStats(len(probes)) for j in range(n_eras)]
+    jobs = [[] for j in range(n_eras)]
+    for j in range(0, n_eras):
+        for k in range(n_bootstraps):
+            logged = log.get(method, j, k) if log is not None else None
+            if logged is not None:
+                for s in range(0, len(logged)):
+                    stat_types[s][j][k] = logged[s]
+                online[j].update(logged)
+                done[j] += 1
+            else:
+                jobs[j].append([j, k, replicate_seed(seed, seed_eras[j], k), None, probes, store, 
+                                convergence, redraw, params[j]])
+    n_jobs = sum(len(era_jobs) for era_jobs in jobs)
+    if not n_jobs:
+        return _ran_replicates(stat_types, stopping)
+    processes, threads = pool_layout(n_jobs, processes, threads)
+    for era_jobs in jobs:
+        for job in era_jobs:
+            job[3] = threads
+    progress = Progress(method, n_jobs)
+
+    def stop(era):
+        if stopping is None or not stopping.satisfied(online[era]):
+            return False
+        print("*******Stopping era %d after %d runs: CIs are narrow enough.*******" % (era+1, done[era]))
+        progress.skip(n_bootstraps - done[era])
+        return True
+
+    # Workers map the encoded corpus read-only from shared memory.
+    shared = corpus.share()
+    try:
+        # Workers forked inside the context tag their events with it.
+        with context(method=method), \
+                _process_pool(processes, _init_bootstrap_worker, (shared,)) as pool:
+            for era, replicate, stats, epochs in _schedule(pool, _bootstrap_replicate, jobs, 
+                                                           2 * processes, stop):
+                for s in range(0, len(stats)):
+                    stat_types[s][era][replicate] = stats[s]
+                online[era].update(stats)
+                if log is not None:
+                    log.append(method, era, replicate, stats, epochs=epochs, 
+                               seed=replicate_seed(seed, seed_eras[era], replicate))
+                done[era] += 1
+                print("Finished with run %d out of %d for era %d." % (done[era], n_bootstraps, era+1))
+                progress.advance()
+                if done[era] == n_bootstraps:
+                    print("*******Finished with era %d.*******" % (era+1))
+    finally:
+        unshare(shared)
+    return _ran_replicates(stat_types, stopping)
+
+
+def overlap_sweep(corpus, fractions, n_bootstraps, processes=None, threads=None, seed=6801, 
+                  probes=EQUALITY_PROBES, store=None, log=None, method='overlap_sweep', 
+                  convergence=None, stopping=None, redraw=0, params=BOOTSTRAP_PARAMS):
+    ''' The overlap bootstrap of 03-overlap_word2vec.py at several        '''
+    ''' overlap fractions in one run: the overlap eras of every fraction   '''
+    ''' are windows over the one EncodedCorpus, and all (fraction, era,   '''
+    ''' replicate) jobs go through a single bootstrap_era_stats pool.     '''
+    ''' Replicate k of era j draws the same seed at every fraction (and   '''
+    ''' as the naive and overlap runs), so fractions are compared on      '''
+    ''' common resamples; fraction 0.1 reproduces the overlap results.    '''
+    ''' With a ResultsLog, replicates are logged under `method` with era  '''
+    ''' f * n_eras + j. Returns {fraction: [stat][era][replicate] lists}.  '''
+    windows = overlap_sweep_corpus(corpus, fractions)
+    n_eras = len(corpus)
+    stat_types = bootstrap_era_stats(windows, n_bootstraps, processes, threads, seed, probes, 
+                                     store, log, method, convergence, stopping, redraw, 
+                                     seed_eras=[j % n_eras for j in range(0, len(windows))], 
+                                     params=params)
+    return dict((fractions[f], [stat[f * n_eras:(f + 1) * n_eras] for stat in stat_types]) 
+                for f in range(0, len(fractions)))
+
+
+def _ran_replicates(stat_types, stopping):
+    # Replicates an adaptive run never started are left out rather than
+    # returned as None.
+    if stopping is None:
+        return stat_types
+    return [[[stat for stat in era if stat is not None] for era in stat] for stat in stat_types]